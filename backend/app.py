@@ -8,8 +8,12 @@ import time
 from datetime import datetime
 import threading
 import logging
+import atexit
+import math
+import tempfile
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
 from typing import Dict, Any, Optional
-import base64
 
 # Configurazione logging
 logging.basicConfig(
@@ -22,9 +26,14 @@ logging.basicConfig(
 )
 logger = logging.getLogger("wallet-scanner")
 
-# Importa le funzioni principali dal modulo scanner.py
-from scanner import scan_wallet, batch_process, generate_recovery_script
-from close_accounts import build_close_accounts_tx
+# scanner, close_accounts e http_client (solana, solders, aiohttp) si importano al primo utilizzo:
+# l'avvio del worker e le pagine statiche non pagano le centinaia di ms del loro import
+from cache import cache_stats
+from result_cache import create_result_cache
+from report_model import json_default
+from async_runtime import LoopThread
+from rate_limit import create_token_buckets
+import metrics
 
 app = Flask(__name__, template_folder='templates', static_folder='static')
 
@@ -37,25 +46,164 @@ CORS(app, origins=[
 ])
 
 # === CACHE E RATE LIMIT ===
-scan_cache = {}
 CACHE_EXPIRY = 300  # 5 minuti
+SCAN_CACHE_BACKEND = os.environ.get("SCAN_CACHE_BACKEND", "sqlite")  # memory | sqlite | redis
+SCAN_CACHE_PATH = os.environ.get("SCAN_CACHE_PATH", "scan_cache.db")
+SCAN_CACHE_MAX_ENTRIES = 5000
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
 
-request_limits = {}
-MAX_REQUESTS_PER_MINUTE = 10
-REQUEST_WINDOW = 60  # secondi
+def _create_scan_cache():
+    try:
+        return create_result_cache(
+            SCAN_CACHE_BACKEND, CACHE_EXPIRY, SCAN_CACHE_MAX_ENTRIES,
+            path=SCAN_CACHE_PATH, url=REDIS_URL
+        )
+    except Exception as e:
+        logger.error(f"Cache scansioni {SCAN_CACHE_BACKEND} non disponibile, uso la memoria: {e}")
+        return create_result_cache("memory", CACHE_EXPIRY, SCAN_CACHE_MAX_ENTRIES)
+
+# Risultati (per wallet) e stati delle scansioni (per scan_id), condivisi tra i worker
+scan_cache = _create_scan_cache()
+
+# === RATE LIMIT IN INGRESSO ===
+# Token bucket per (gruppo di route, IP): memoria fissa per chiave e chiavi inattive rimosse.
+# REQUEST_LIMIT_BACKEND=sqlite condivide i budget tra tutti i worker gunicorn della macchina.
+REQUEST_LIMIT_BACKEND = os.environ.get("REQUEST_LIMIT_BACKEND", "memory")
+REQUEST_LIMIT_PATH = os.environ.get("REQUEST_LIMIT_PATH", "request_limits.db")
+# Gruppo -> (richieste al minuto, burst). Il polling dello stato costa poco, le scansioni molto.
+REQUEST_BUDGETS = {
+    "scan": (10, 10),
+    "tx": (20, 10),
+    "status": (120, 30),
+    "default": (60, 20),
+}
+# Endpoint Flask -> gruppo; None = non limitato (file statici)
+ROUTE_BUDGETS = {
+    "static": None,
+    "scan": "scan",
+    "api_scan": "scan",
+    "batch_scan": "scan",
+    "generate_recovery": "scan",
+    "api_close": "tx",
+    "send_signed_tx": "tx",
+    "check_status": "status",
+    "stream_status": "status",
+}
+
+def _create_request_buckets():
+    try:
+        return create_token_buckets(REQUEST_LIMIT_BACKEND, REQUEST_LIMIT_PATH)
+    except Exception as e:
+        logger.warning(f"Rate limiter {REQUEST_LIMIT_BACKEND} non disponibile, uso la memoria: {e}")
+        return create_token_buckets("memory")
+
+request_buckets = _create_request_buckets()
+requests_rate_limited = metrics.Counter("requests_rate_limited_total", "Richieste in ingresso rifiutate (429) per gruppo", ["group"])
 
 # === GESTORE SCANSIONI IN BACKGROUND ===
+SCAN_WORKERS = int(os.environ.get("SCAN_WORKERS", "4"))        # scansioni contemporanee per worker gunicorn
+SCAN_QUEUE_SIZE = int(os.environ.get("SCAN_QUEUE_SIZE", "100"))  # scansioni in attesa oltre le quali si rifiuta
+SCAN_RETENTION = 600  # secondi di permanenza degli stati delle scansioni concluse
+SCAN_PRUNE_INTERVAL = 30
+# Attesa massima di un handler su scansione o loop (sotto il --timeout di gunicorn): poi 504
+REQUEST_TIMEOUT = int(os.environ.get("REQUEST_TIMEOUT", "90"))
+REQUEST_TIMEOUT_MESSAGE = "Operazione troppo lenta, riprova tra qualche minuto."
+
+class ScanQueueFull(Exception):
+    pass
+
 class ScanManager:
-    def __init__(self):
+    """
+    Esecutore delle scansioni: SCAN_WORKERS coroutine su un unico event loop
+    persistente, coda limitata a SCAN_QUEUE_SIZE e stati rimossi dopo SCAN_RETENTION.
+    """
+    def __init__(self, workers=SCAN_WORKERS, queue_size=SCAN_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
         self.pending_scans = {}
+        # Scansioni in corso per wallet: chi arriva dopo si aggancia invece di ripartire
+        self.inflight = {}
+        # Wallet in attesa di un worker, in ordine di arrivo (per la posizione in coda)
+        self.waiting = deque()
         self.lock = threading.Lock()
-    
+        # Eventi di avanzamento per scan_id (stessa lista della scansione in corso), letti da /stream
+        self.events = {}
+        self.events_changed = threading.Condition(self.lock)
+        self.runtime = LoopThread("scan-loop")
+        self.queue = None
+        self._tasks = []
+        self._last_prune = 0.0
+
+    def _ensure_started(self):
+        if self.queue is not None:
+            return
+        with self.lock:
+            if self.queue is not None:
+                return
+            self.runtime.run(self._start_workers())
+            atexit.register(self.shutdown)
+
+    async def _start_workers(self):
+        self.queue = asyncio.Queue()
+        self._tasks = [asyncio.get_running_loop().create_task(self._worker()) for _ in range(self.workers)]
+
+    async def _stop_workers(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        # Solo i moduli già caricati hanno client aperti: niente import pesanti all'uscita
+        if "scanner" in sys.modules:
+            await sys.modules["scanner"].close_clients()
+        if "close_accounts" in sys.modules:
+            await sys.modules["close_accounts"].close_client()
+
+    def shutdown(self):
+        self.runtime.stop(cleanup=self._stop_workers)
+
+    def run(self, coro, timeout=REQUEST_TIMEOUT):
+        """
+        Esegue una coroutine (transazioni, script di recupero) sullo stesso loop delle scansioni.
+        Oltre timeout la coroutine viene annullata e si solleva FutureTimeout.
+        """
+        self._ensure_started()
+        return self.runtime.run(coro, timeout)
+
     def get_scan_status(self, scan_id):
         with self.lock:
-            return self.pending_scans.get(scan_id, {"status": "not_found"})
-    
+            status = self.pending_scans.get(scan_id)
+            if status is not None:
+                status = dict(status)
+                if status["status"] == "pending":
+                    status["queue_position"] = self._queue_position(status["wallet"])
+        if status is None:
+            # La scansione può essere stata avviata da un altro worker
+            status = scan_cache.get(f"scan:{scan_id}")
+        return status or {"status": "not_found"}
+
+    def _queue_position(self, wallet_address):
+        # 0 = in esecuzione, n = n-esima in attesa
+        try:
+            return self.waiting.index(wallet_address) + 1
+        except ValueError:
+            return 0
+
+    def queue_depth(self):
+        with self.lock:
+            return len(self.waiting)
+
     def register_scan(self, scan_id, wallet_address):
+        """Avvia una scansione in background; se il wallet è già in scansione restituisce quello scan_id."""
+        self._ensure_started()
         with self.lock:
+            self._prune_finished()
+            flight = self.inflight.get(wallet_address)
+            if flight and flight["scan_id"]:
+                logger.info(f"Scansione già in corso per {wallet_address}: {flight['scan_id']}")
+                return flight["scan_id"]
+            if flight is None:
+                flight = self._start_flight(wallet_address, True)
+            flight["scan_id"] = scan_id
+            self.events[scan_id] = flight["events"]
             self.pending_scans[scan_id] = {
                 "status": "pending",
                 "wallet": wallet_address,
@@ -63,55 +211,157 @@ class ScanManager:
                 "result": None,
                 "error": None
             }
-        # Avvia thread per la scansione
-        threading.Thread(
-            target=self._run_scan_thread,
-            args=(scan_id, wallet_address),
-            daemon=True
-        ).start()
+            status = dict(self.pending_scans[scan_id])
+        scan_cache.set(f"scan:{scan_id}", status)
         return scan_id
-    
-    def _run_scan_thread(self, scan_id, wallet_address):
-        try:
-            if sys.platform == 'win32':
-                asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            report = loop.run_until_complete(scan_wallet(wallet_address, detailed=True))
-            loop.close()
+
+    def scan_now(self, wallet_address, timeout=REQUEST_TIMEOUT):
+        """
+        Scansione sincrona: si aggancia a quella in corso per lo stesso wallet, se c'è.
+        Oltre timeout solleva FutureTimeout; la scansione continua e il risultato finisce in cache.
+        """
+        self._ensure_started()
+        with self.lock:
+            flight = self.inflight.get(wallet_address)
+            if flight is None:
+                flight = self._start_flight(wallet_address, False)
+            else:
+                logger.info(f"In attesa della scansione già in corso per {wallet_address}")
+        return flight["future"].result(timeout)
+
+    def _start_flight(self, wallet_address, detailed):
+        # Da chiamare con self.lock acquisito
+        if len(self.waiting) >= self.queue_size:
+            raise ScanQueueFull("Troppe scansioni in coda. Riprova tra qualche minuto.")
+        flight = {"scan_id": None, "future": Future(), "events": []}
+        self.inflight[wallet_address] = flight
+        self.waiting.append(wallet_address)
+        self.runtime.call_soon(self.queue.put_nowait, (wallet_address, flight, detailed))
+        return flight
+
+    def _publish(self, events, event, data):
+        with self.events_changed:
+            events.append((event, data))
+            self.events_changed.notify_all()
+
+    def wait_events(self, scan_id, index, timeout):
+        """Eventi di scan_id dalla posizione index in poi; attende fino a timeout se non ce ne sono di nuovi."""
+        with self.events_changed:
+            events = self.events.get(scan_id)
+            if events is None:
+                return None
+            self.events_changed.wait_for(lambda: len(events) > index, timeout)
+            return events[index:]
+
+    async def _worker(self):
+        from scanner import scan_wallet
+        while True:
+            wallet_address, flight, detailed = await self.queue.get()
+            future, events = flight["future"], flight["events"]
             with self.lock:
+                self.waiting.remove(wallet_address)
+            self._publish(events, "started", {"wallet": wallet_address})
+            error = None
+            try:
+                report = await scan_wallet(
+                    wallet_address, detailed=detailed,
+                    progress=lambda event, data: self._publish(events, event, data)
+                )
+                if report and report.get("error"):
+                    # Report a zero per errori RPC/provider: né in cache né restituito come risultato
+                    raise Exception(report["error"])
                 if report:
-                    self.pending_scans[scan_id]["status"] = "completed"
-                    self.pending_scans[scan_id]["result"] = report
-                    scan_cache[wallet_address] = {
-                        "timestamp": time.time(),
-                        "data": report
-                    }
-                else:
-                    self.pending_scans[scan_id]["status"] = "failed"
-                    self.pending_scans[scan_id]["error"] = "Scansione fallita"
-        except Exception as e:
-            logger.error(f"Errore durante la scansione {scan_id}: {str(e)}")
+                    await asyncio.to_thread(scan_cache.set, wallet_address, report)
+            except Exception as e:
+                logger.error(f"Errore durante la scansione di {wallet_address}: {str(e)}")
+                report, error = None, e
+            finally:
+                self.queue.task_done()
             with self.lock:
+                self.inflight.pop(wallet_address, None)
+                scan_id = flight["scan_id"]
+            if scan_id:
+                # Stato condiviso (SQLite/Redis) scritto fuori dal loop: le altre scansioni non si fermano
+                await asyncio.to_thread(self._finish_scan, scan_id, report, error)
+            if error:
+                future.set_exception(error)
+                self._publish(events, "end", {"status": "failed", "error": str(error)})
+            else:
+                future.set_result(report)
+                if report:
+                    self._publish(events, "end", {"status": "completed"})
+                else:
+                    self._publish(events, "end", {"status": "failed", "error": "Scansione fallita"})
+
+    def _finish_scan(self, scan_id, report, error):
+        with self.lock:
+            if report:
+                self.pending_scans[scan_id]["status"] = "completed"
+                self.pending_scans[scan_id]["result"] = report
+            else:
                 self.pending_scans[scan_id]["status"] = "failed"
-                self.pending_scans[scan_id]["error"] = str(e)
+                self.pending_scans[scan_id]["error"] = str(error) if error else "Scansione fallita"
+            self.pending_scans[scan_id]["end_time"] = time.time()
+            status = dict(self.pending_scans[scan_id])
+        scan_cache.set(f"scan:{scan_id}", status)
+
+    def _prune_finished(self):
+        # Da chiamare con self.lock acquisito
+        now = time.time()
+        if now - self._last_prune < SCAN_PRUNE_INTERVAL:
+            return
+        self._last_prune = now
+        expired = [
+            scan_id for scan_id, status in self.pending_scans.items()
+            if status.get("end_time") and now - status["end_time"] > SCAN_RETENTION
+        ]
+        for scan_id in expired:
+            del self.pending_scans[scan_id]
+            self.events.pop(scan_id, None)
 
 scan_manager = ScanManager()
 
+# === WARM-UP ===
+# WARMUP=1: all'avvio un thread in background importa scanner e close_accounts, avvia il loop
+# delle scansioni e apre sessione HTTP e connessione RPC, così la prima scansione non paga
+# l'avvio a freddo. Vale per ogni worker gunicorn (non con --preload: il thread non sopravvive al fork).
+WARMUP = os.environ.get("WARMUP", "0") == "1"
+
+async def _warm_connections():
+    import scanner
+    scanner.get_session()
+    await scanner.async_solana_client.execute_with_retry("get_slot")
+
+def warm_up():
+    start = time.perf_counter()
+    try:
+        import scanner, close_accounts
+        logger.info(f"Warm-up: moduli importati in {time.perf_counter() - start:.2f}s")
+        scan_manager.run(_warm_connections())
+        logger.info(f"Warm-up completato in {time.perf_counter() - start:.2f}s")
+    except Exception as e:
+        logger.warning(f"Warm-up non completato: {e}")
+
+if WARMUP:
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
 @app.before_request
 def limit_request_rate():
-    ip = request.remote_addr
-    current_time = time.time()
-    if ip in request_limits:
-        request_limits[ip] = [timestamp for timestamp in request_limits[ip] 
-                             if current_time - timestamp < REQUEST_WINDOW]
-    else:
-        request_limits[ip] = []
-    if len(request_limits[ip]) >= MAX_REQUESTS_PER_MINUTE:
-        return jsonify({
-            "error": "Troppe richieste. Riprova tra qualche minuto."
-        }), 429
-    request_limits[ip].append(current_time)
+    group = ROUTE_BUDGETS.get(request.endpoint, "default")
+    if group is None:
+        return
+    per_minute, burst = REQUEST_BUDGETS[group]
+    try:
+        wait = request_buckets.try_acquire(f"{group}:{request.remote_addr}", per_minute / 60, burst)
+    except Exception as e:
+        # Archivio condiviso non raggiungibile: meglio servire la richiesta che rifiutarla
+        logger.warning(f"Errore del rate limiter: {e}")
+        return
+    if wait > 0:
+        requests_rate_limited.inc(group=group)
+        response = jsonify({"error": "Troppe richieste. Riprova tra qualche minuto."})
+        response.headers["Retry-After"] = str(math.ceil(wait))
+        return response, 429
 
 @app.route("/")
 def index():
@@ -127,21 +377,93 @@ def scan():
         return jsonify({"error": "Tipo wallet non supportato"}), 400
     if wallet_type == "coinbase":
         return jsonify({"error": "Supporto Coinbase in arrivo. Al momento solo Solana/Phantom."}), 400
-    if wallet_address in scan_cache:
-        cache_entry = scan_cache[wallet_address]
-        if time.time() - cache_entry["timestamp"] < CACHE_EXPIRY:
-            logger.info(f"Risultato in cache per {wallet_address}")
-            return jsonify({
-                "status": "completed",
-                "cached": True,
-                "result": cache_entry["data"]
-            })
+    cached = scan_cache.get(wallet_address)
+    if cached is not None:
+        logger.info(f"Risultato in cache per {wallet_address}")
+        return jsonify({
+            "status": "completed",
+            "cached": True,
+            "result": cached
+        })
     scan_id = f"{int(time.time())}-{wallet_address[:8]}"
-    scan_manager.register_scan(scan_id, wallet_address)
+    try:
+        scan_id = scan_manager.register_scan(scan_id, wallet_address)
+    except ScanQueueFull as e:
+        return jsonify({"error": str(e)}), 503
     return jsonify({
         "status": "pending",
         "scan_id": scan_id,
-        "message": "Scansione avviata. Usa l'endpoint /status per controllare lo stato."
+        "stream": f"/stream/{scan_id}",
+        "message": "Scansione avviata. Usa l'endpoint /stream (o /status) per seguire l'avanzamento."
+    })
+
+STREAM_KEEPALIVE = 15  # secondi tra due commenti keep-alive sullo stream SSE
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=json_default)}\n\n"
+
+STREAM_POLL_INTERVAL = 1  # secondi tra due letture di scan_cache per le scansioni di altri worker
+# Ogni connessione /stream o /batch occupa un thread gthread per tutta la sua durata:
+# il tetto va tenuto sotto --threads (8 in render.yaml e Dockerfile) per lasciare
+# thread liberi a /scan, /status e alle altre richieste brevi
+STREAM_MAX_CONNECTIONS = int(os.environ.get("STREAM_MAX_CONNECTIONS", "6"))
+STREAM_RETRY_AFTER = 5  # secondi suggeriti al client quando gli stream sono tutti occupati
+stream_slots = threading.BoundedSemaphore(STREAM_MAX_CONNECTIONS)
+
+def streaming_response(generate, **kwargs):
+    # Lo slot si libera alla chiusura della risposta, anche se il client se ne va prima
+    response = Response(generate(), **kwargs)
+    response.call_on_close(stream_slots.release)
+    return response
+
+def follow_shared_status(scan_id, status):
+    """
+    Scansione di un altro worker gunicorn (o già rimossa da questo): niente eventi di
+    avanzamento, si rilegge lo stato condiviso in scan_cache finché non si conclude.
+    """
+    last_sent = time.monotonic()
+    while status["status"] == "pending":
+        time.sleep(STREAM_POLL_INTERVAL)
+        if time.monotonic() - last_sent >= STREAM_KEEPALIVE:
+            last_sent = time.monotonic()
+            yield ": keep-alive\n\n"
+        status = scan_manager.get_scan_status(scan_id)
+    if status["status"] == "completed":
+        yield sse_event("report", status["result"])
+    yield sse_event("end", {"status": status["status"], "error": status.get("error")})
+
+@app.route("/stream/<scan_id>", methods=["GET"])
+def stream_status(scan_id):
+    """Avanzamento della scansione come Server-Sent Events, fino all'evento "end"."""
+    status = scan_manager.get_scan_status(scan_id)
+    if status["status"] == "not_found":
+        return jsonify({"error": "Scansione non trovata"}), 404
+    if not stream_slots.acquire(blocking=False):
+        return jsonify({
+            "error": "Troppi stream aperti, segui la scansione con /status",
+            "status_url": f"/status/{scan_id}",
+        }), 503, {"Retry-After": str(STREAM_RETRY_AFTER)}
+
+    def generate():
+        yield sse_event("status", {k: v for k, v in status.items() if k != "result"})
+        index = 0
+        while True:
+            events = scan_manager.wait_events(scan_id, index, STREAM_KEEPALIVE)
+            if events is None:
+                yield from follow_shared_status(scan_id, status)
+                return
+            if not events:
+                yield ": keep-alive\n\n"
+                continue
+            for event, data in events:
+                yield sse_event(event, data)
+                if event == "end":
+                    return
+            index += len(events)
+
+    return streaming_response(generate, mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
     })
 
 @app.route("/status/<scan_id>", methods=["GET"])
@@ -154,6 +476,8 @@ def check_status(scan_id):
         "wallet": status["wallet"],
         "elapsed": round(time.time() - status["start_time"], 2)
     }
+    if status["status"] == "pending" and "queue_position" in status:
+        response["queue_position"] = status["queue_position"]
     if status["status"] == "completed":
         response["result"] = status["result"]
     elif status["status"] == "failed":
@@ -167,30 +491,39 @@ def batch_scan():
     file = request.files["file"]
     if file.filename == "":
         return jsonify({"error": "Nessun file selezionato"}), 400
-    temp_path = f"temp_batch_{int(time.time())}.txt"
-    file.save(temp_path)
+    if not stream_slots.acquire(blocking=False):
+        return jsonify({"error": "Troppe connessioni in streaming, riprova tra poco"}), 503, {
+            "Retry-After": str(STREAM_RETRY_AFTER)
+        }
     try:
-        if sys.platform == 'win32':
-            asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        export_format = request.form.get("export_format", "json")
-        detailed = request.form.get("detailed", "false").lower() == "true"
-        results = loop.run_until_complete(batch_process(temp_path, export_format, detailed))
-        loop.close()
-        os.remove(temp_path)
-        if not results:
-            return jsonify({"error": "Nessun risultato dalla scansione batch"}), 500
-        return jsonify({
-            "status": "completed",
-            "wallets_processed": len(results),
-            "results": results
-        })
-    except Exception as e:
-        logger.error(f"Errore durante la scansione batch: {str(e)}")
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-        return jsonify({"error": str(e)}), 500
+        # Nome univoco: due upload nello stesso secondo non si sovrascrivono
+        fd, temp_path = tempfile.mkstemp(prefix="temp_batch_", suffix=".txt")
+        os.close(fd)
+        file.save(temp_path)
+    except Exception:
+        stream_slots.release()
+        raise
+    export_format = request.form.get("export_format", "json")
+    detailed = request.form.get("detailed", "false").lower() == "true"
+
+    def generate():
+        # Un report NDJSON per wallet appena completato, poi una riga di riepilogo
+        processed = 0
+        try:
+            from scanner import stream_batch
+            batch = stream_batch(temp_path, export_format=export_format, detailed=detailed)
+            for report in scan_manager.runtime.iterate(batch):
+                processed += 1
+                yield json.dumps(report, default=json_default) + "\n"
+            yield json.dumps({"status": "completed", "wallets_processed": processed}) + "\n"
+        except Exception as e:
+            logger.error(f"Errore durante la scansione batch: {str(e)}")
+            yield json.dumps({"status": "failed", "wallets_processed": processed, "error": str(e)}) + "\n"
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    return streaming_response(generate, mimetype="application/x-ndjson")
 
 @app.route("/recovery", methods=["POST"])
 def generate_recovery():
@@ -202,13 +535,17 @@ def generate_recovery():
         filename = f"recovery_{wallet_address[:8]}_{timestamp}.sh"
         filepath = os.path.join("static", "scripts", filename)
         os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        generate_recovery_script(wallet_address, filepath)
+        from scanner import generate_recovery_script
+        scan_manager.run(generate_recovery_script(wallet_address, filepath))
         script_url = f"/static/scripts/{filename}"
         return jsonify({
             "status": "completed",
             "script_url": script_url,
             "message": "Script di recupero generato con successo"
         })
+    except FutureTimeout:
+        logger.error(f"Timeout durante la generazione dello script per {wallet_address}")
+        return jsonify({"error": REQUEST_TIMEOUT_MESSAGE}), 504
     except Exception as e:
         logger.error(f"Errore durante la generazione dello script: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -233,12 +570,12 @@ def server_error(e):
 @app.route("/api/scan/<wallet>", methods=["GET"])
 def api_scan(wallet):
     try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        data = loop.run_until_complete(scan_wallet(wallet, export_format="", detailed=False))
-        if not data:
-            logger.error(f"Scan failed for wallet {wallet}")
-            return jsonify({"error": "Scan failed"}), 400
+        data = scan_cache.get(wallet)
+        if data is None:
+            data = scan_manager.scan_now(wallet)
+            if not data:
+                logger.error(f"Scan failed for wallet {wallet}")
+                return jsonify({"error": "Scan failed"}), 400
         reclaimable_lamports = int(data.get("rent_reclaimable", 0) * 1_000_000_000)
         reclaimable_sol = round(reclaimable_lamports * 0.9 / 1_000_000_000, 6)
         return jsonify({
@@ -249,10 +586,69 @@ def api_scan(wallet):
             "reclaimable_lamports": reclaimable_lamports,
             "reclaimable_sol": reclaimable_sol
         })
+    except ScanQueueFull as e:
+        return jsonify({"error": str(e)}), 503
+    except FutureTimeout:
+        logger.error(f"/api/scan timeout for {wallet}")
+        return jsonify({"error": REQUEST_TIMEOUT_MESSAGE}), 504
     except Exception as e:
         logger.error(f"/api/scan error for {wallet}: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route("/api/pool_stats", methods=["GET"])
+def api_pool_stats():
+    from http_client import pool_stats
+    return jsonify(pool_stats())
+
+@app.route("/api/rpc_stats", methods=["GET"])
+def api_rpc_stats():
+    import scanner
+    return jsonify(scanner.rpc_pool.stats())
+
+@app.route("/api/cache_stats", methods=["GET"])
+def api_cache_stats():
+    import scanner  # registra le cache dei metadati
+    return jsonify(cache_stats())
+
+def collect_metrics():
+    # Metriche calcolate al momento dello scrape: coda, cache, pool HTTP, salute degli endpoint RPC
+    import scanner
+    from http_client import pool_stats
+    caches = cache_stats()
+    pool = pool_stats()
+    rpc = scanner.rpc_pool.stats()
+    with scan_manager.lock:
+        inflight = len(scan_manager.inflight)
+    return [
+        ("scan_queue_depth", "Scansioni in attesa di un worker", "gauge", [({}, scan_manager.queue_depth())]),
+        ("scans_inflight", "Scansioni in corso o in coda (per wallet)", "gauge", [({}, inflight)]),
+        ("cache_hits_total", "Hit per cache", "counter", [({"cache": n}, c["hits"]) for n, c in caches.items()]),
+        ("cache_misses_total", "Miss per cache", "counter", [({"cache": n}, c["misses"]) for n, c in caches.items()]),
+        ("cache_evictions_total", "Voci rimosse per limite di dimensione", "counter",
+         [({"cache": n}, c["evictions"]) for n, c in caches.items()]),
+        ("cache_hit_ratio", "Rapporto hit/lookup per cache", "gauge", [({"cache": n}, c["hit_ratio"]) for n, c in caches.items()]),
+        ("cache_size", "Voci in cache", "gauge", [({"cache": n}, c["size"]) for n, c in caches.items()]),
+        ("http_connections", "Connessioni del pool HTTP per stato", "gauge",
+         [({"state": "in_use"}, pool["connections_in_use"]), ({"state": "idle"}, pool["connections_idle"])]),
+        ("http_requests_total", "Richieste HTTP inviate dal pool", "counter", [({}, pool["requests"])]),
+        ("http_connections_created_total", "Connessioni HTTP aperte", "counter", [({}, pool["connections_created"])]),
+        ("http_connections_reused_total", "Connessioni HTTP riutilizzate", "counter", [({}, pool["connections_reused"])]),
+        ("provider_rate_limited_total", "Risposte 429 dai provider", "counter", [({}, scanner.api_stats["rate_limited"])]),
+        ("provider_errors_total", "Errori 5xx o di rete dai provider", "counter", [({}, scanner.api_stats["errors"])]),
+        ("rpc_hedged_requests_total", "Richieste RPC duplicate oltre il p95", "counter", [({}, rpc["hedged_requests"])]),
+        ("rpc_errors_total", "Tentativi RPC falliti (client async)", "counter", [({}, scanner.async_solana_client.error_count)]),
+        ("rpc_endpoint_up", "1 se il circuito dell'endpoint non è aperto", "gauge",
+         [({"endpoint": e["endpoint"]}, 0 if e["state"] == "open" else 1) for e in rpc["endpoints"]]),
+        ("rpc_endpoint_latency_seconds", "Latenza media mobile per endpoint", "gauge",
+         [({"endpoint": e["endpoint"]}, e["latency_ewma_ms"] / 1000) for e in rpc["endpoints"] if e["latency_ewma_ms"] is not None]),
+        ("rpc_endpoint_error_rate", "Tasso d'errore (media mobile) per endpoint", "gauge",
+         [({"endpoint": e["endpoint"]}, e["error_rate"]) for e in rpc["endpoints"]]),
+    ]
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.render(collect_metrics()), mimetype="text/plain; version=0.0.4")
+
 @app.route("/api/close", methods=["POST"])
 def api_close():
     req = request.get_json()
@@ -261,9 +657,15 @@ def api_close():
     reclaimable_lamports = req.get("reclaimable_lamports", 0)
     if not user_pubkey or not empty_accounts or not reclaimable_lamports:
         return jsonify({"error": "Missing parameters"}), 400
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    tx = loop.run_until_complete(build_close_accounts_tx(user_pubkey, empty_accounts, reclaimable_lamports))
+    try:
+        from close_accounts import build_close_accounts_tx
+        tx = scan_manager.run(build_close_accounts_tx(user_pubkey, empty_accounts, reclaimable_lamports))
+    except FutureTimeout:
+        logger.error("Timeout durante la preparazione della transazione")
+        return jsonify({"error": REQUEST_TIMEOUT_MESSAGE}), 504
+    except Exception as e:
+        logger.error(f"Errore durante la preparazione della transazione: {str(e)}")
+        return jsonify({"error": str(e)}), 500
     return jsonify(tx)
 
 @app.route("/api/send_signed_tx", methods=["POST"])
@@ -273,23 +675,11 @@ def send_signed_tx():
     if not signed_tx:
         return jsonify({"error": "Missing signed_tx"}), 400
     try:
-        from solana.rpc.async_api import AsyncClient
-        from solana.rpc.types import TxOpts
-        from solana.transaction import Transaction
-        async def send():
-            from config import ALCHEMY_RPC
-            async with AsyncClient(ALCHEMY_RPC) as client:
-                tx_bytes = base64.b64decode(signed_tx)
-                tx = Transaction.deserialize(tx_bytes)
-                resp = await client.send_raw_transaction(tx.serialize(), opts=TxOpts(skip_preflight=True))
-                return resp
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        resp = loop.run_until_complete(send())
-        if "result" in resp:
-            return jsonify({"txid": resp["result"]})
-        else:
-            return jsonify({"error": resp}), 400
+        from close_accounts import send_signed_transaction
+        txid = scan_manager.run(send_signed_transaction(signed_tx))
+        return jsonify({"txid": txid})
+    except FutureTimeout:
+        return jsonify({"error": REQUEST_TIMEOUT_MESSAGE}), 504
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
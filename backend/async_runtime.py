@@ -0,0 +1,91 @@
+import asyncio
+import sys
+import threading
+from concurrent.futures import TimeoutError as FutureTimeout
+
+class LoopThread:
+    """
+    Event loop asyncio persistente in un thread dedicato.
+    I thread sincroni (handler Flask) vi inviano coroutine con submit()/run(),
+    così client HTTP e RPC restano aperti e condivisi tra le richieste.
+    """
+    def __init__(self, name="asyncio-loop"):
+        self.name = name
+        self.loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return self.loop
+            if sys.platform == 'win32':
+                asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+            self.loop = asyncio.new_event_loop()
+            ready = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(ready,), name=self.name, daemon=True)
+            self._thread.start()
+            ready.wait()
+            return self.loop
+
+    def _run(self, ready):
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(ready.set)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """Pianifica la coroutine sul loop e restituisce un concurrent.futures.Future."""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """
+        Esegue la coroutine sul loop e attende il risultato dal thread chiamante.
+        Scaduto il timeout la coroutine viene annullata e si solleva TimeoutError.
+        """
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise
+
+    def iterate(self, agen):
+        """Consuma un async generator sul loop da codice sincrono (es. risposte Flask in streaming)."""
+        async def next_item():
+            return await agen.__anext__()
+
+        async def close():
+            await agen.aclose()
+
+        try:
+            while True:
+                try:
+                    item = self.run(next_item())
+                except StopAsyncIteration:
+                    return
+                yield item
+        finally:
+            # Chiusura anticipata (es. client disconnesso): chiude anche il generator asincrono
+            self.run(close())
+
+    def call_soon(self, callback, *args):
+        self.start()
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def stop(self, cleanup=None, timeout=10):
+        # cleanup: coroutine function eseguita sul loop prima di fermarlo (es. chiusura client)
+        with self._lock:
+            thread, loop = self._thread, self.loop
+            self._thread = None
+        if thread is None or not thread.is_alive():
+            return
+        if cleanup is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(cleanup(), loop).result(timeout)
+            except Exception as e:
+                print(f"Loop cleanup error: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+        if not thread.is_alive():
+            loop.close()
@@ -0,0 +1,523 @@
+"""
+Benchmark offline di scan_wallet, batch_process e build_close_accounts_tx.
+
+Avvia server locali che imitano l'RPC Solana (JSON-RPC, con account mint e metadati
+Metaplex binari) e le API Solscan e Jupiter, con latenza, errori 5xx e 429 configurabili, e wallet sintetici da
+1 a 5.000 token account. Riporta percentili di latenza, chiamate RPC/HTTP e picco
+di memoria senza toccare mainnet né i provider reali.
+
+Esempi:
+    python benchmark.py
+    python benchmark.py --sizes 1,100,1000,5000 --runs 5 --latency 0.05 --error-rate 0.02 --rate-limit-rate 0.01
+    python benchmark.py --scenarios batch --batch-wallets 200 --batch-accounts 50 --output bench.json
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import hashlib
+import json
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from urllib.parse import urlparse
+
+# Il benchmark parte sempre a freddo: niente archivio persistente dei metadati
+os.environ.setdefault("MINT_STORE_PATH", "")
+
+from aiohttp import web
+from solders.pubkey import Pubkey as PublicKey
+
+import close_accounts
+import onchain
+import scanner
+from async_runtime import LoopThread
+from cache import clear_caches
+from http_client import pool_stats
+from rpc_client import AsyncEnhancedSolanaClient, EndpointPool
+
+DEFAULT_SIZES = "1,10,100,1000,5000"
+FUNGIBLE_POOL = 2000          # mint fungibili condivisi tra i wallet sintetici
+TOKEN_ACCOUNT_RENT = 2039280  # lamports di un token account (165 byte)
+SLOT = 250_000_000
+BLOCKHASH = "EkSnNWid2cvwEVnVx9aBqawnmiCNiDgp3gUdkDPTKN1N"
+UNLIMITED_RATE = 1e9
+
+def synthetic_key(*parts) -> str:
+    return str(PublicKey(hashlib.sha256("-".join(map(str, parts)).encode()).digest()))
+
+def encode_mint(supply, decimals) -> bytes:
+    # Layout SPL Mint (82 byte): nessuna mint/freeze authority
+    return struct.pack("<I32sQB?I32s", 0, bytes(32), supply, decimals, True, 0, bytes(32))
+
+def encode_token_account(mint, owner, amount) -> bytes:
+    # Layout SPL Account (165 byte): nessun delegate, stato inizializzato
+    return struct.pack(
+        "<32s32sQI32sBIQQI32s", bytes(PublicKey.from_string(mint)), bytes(PublicKey.from_string(owner)),
+        amount, 0, bytes(32), 1, 0, 0, 0, 0, bytes(32)
+    )
+
+def _borsh_string(value, size) -> bytes:
+    raw = value.encode()
+    return struct.pack("<I", size) + raw + bytes(size - len(raw))
+
+def encode_metadata(mint, name, symbol, uri, token_standard=None, collection=None) -> bytes:
+    # Layout Metadata V1 con i campi di lunghezza fissa di Metaplex (nome 32, simbolo 10, URI 200)
+    data = bytes([onchain.METADATA_KEY_V1]) + bytes(32) + bytes(PublicKey.from_string(mint))
+    data += _borsh_string(name, 32) + _borsh_string(symbol, 10) + _borsh_string(uri, 200)
+    data += struct.pack("<H", 500) + b"\x00" + b"\x00\x01" + b"\x00"
+    data += b"\x00" if token_standard is None else bytes([1, token_standard])
+    data += b"\x00" if collection is None else b"\x01\x01" + bytes(PublicKey.from_string(collection))
+    return data + bytes(679 - len(data)) if len(data) < 679 else data
+
+class SyntheticChain:
+    """
+    Wallet e mint sintetici e deterministici. Per ogni 20 account: 3 NFT, 12 token
+    posseduti e 5 account vuoti. Ogni mint ha il suo account on-chain; un mint fungibile
+    su 10 non ha metadati Metaplex (fallback Jupiter token list), uno su 10 non ha prezzo
+    Jupiter (fallback Solscan) e un NFT su 3 ha metadati senza token standard.
+    """
+    def __init__(self):
+        self.fungible = [synthetic_key("mint", i) for i in range(FUNGIBLE_POOL)]
+        self.fungible_index = {mint: i for i, mint in enumerate(self.fungible)}
+        self.nfts = set()
+        self.accounts = {}   # wallet -> account JSON-RPC
+        self._rendered = {}  # (wallet, codifica) -> risultato getTokenAccountsByOwner già serializzato
+        self.raw = {}        # indirizzo -> dati binari (mint e metadati Metaplex)
+        self.collection = synthetic_key("collection")
+        self._add_mint(self.collection, 1, 0, "Synthetic Collection", "SCOL", 0)
+        for i, mint in enumerate(self.fungible):
+            if i % 10 == 9:
+                self._add_mint(mint, 10 ** 15, 6)
+            else:
+                self._add_mint(mint, 10 ** 15, 6, f"Token {mint[:6]}", mint[:4].upper(), 2)
+
+    def _add_mint(self, mint, supply, decimals, name=None, symbol="", token_standard=None, collection=None):
+        self.raw[mint] = encode_mint(supply, decimals)
+        if name is not None:
+            self.raw[str(onchain.metadata_address(mint))] = encode_metadata(
+                mint, name, symbol, f"https://example.invalid/{mint}.json", token_standard, collection
+            )
+
+    def raw_account(self, address):
+        data = self.raw.get(address)
+        if data is None:
+            return None
+        return {
+            "lamports": TOKEN_ACCOUNT_RENT, "owner": scanner.TOKEN_PROGRAM_ID, "executable": False,
+            "rentEpoch": 0, "space": len(data), "data": [base64.b64encode(data).decode(), "base64"],
+        }
+
+    def wallet(self, accounts: int, tag=0) -> str:
+        owner = synthetic_key("wallet", accounts, tag)
+        if owner not in self.accounts:
+            self.accounts[owner] = [self._account(owner, i) for i in range(accounts)]
+            self._rendered[owner, "jsonParsed"] = json.dumps({"context": {"slot": SLOT}, "value": self.accounts[owner]})
+            self._rendered[owner, "base64"] = json.dumps({"context": {"slot": SLOT}, "value": [
+                {"pubkey": acc["pubkey"], "account": dict(acc["account"], data=[base64.b64encode(encode_token_account(
+                    info["mint"], owner, int(info["tokenAmount"]["amount"])
+                )).decode(), "base64"])}
+                for acc in self.accounts[owner]
+                for info in [acc["account"]["data"]["parsed"]["info"]]
+            ]})
+        return owner
+
+    def _account(self, owner, i):
+        position = i % 20
+        if position < 3:
+            mint = synthetic_key("nft", owner, i)
+            self.nfts.add(mint)
+            self._add_mint(mint, 1, 0, f"Synthetic NFT {mint[:6]}", "SNFT",
+                           None if i % 3 == 0 else 0, self.collection)
+            amount, decimals = 1, 0
+        else:
+            mint = self.fungible[(i * 7) % FUNGIBLE_POOL]
+            amount, decimals = (0 if position >= 15 else (i + 1) * 1000), 6
+        ui_amount = amount / (10 ** decimals)
+        return {
+            "pubkey": synthetic_key("account", owner, i),
+            "account": {
+                "lamports": TOKEN_ACCOUNT_RENT,
+                "owner": scanner.TOKEN_PROGRAM_ID,
+                "executable": False,
+                "rentEpoch": 0,
+                "space": 165,
+                "data": {
+                    "program": "spl-token",
+                    "space": 165,
+                    "parsed": {
+                        "type": "account",
+                        "info": {
+                            "mint": mint,
+                            "owner": owner,
+                            "state": "initialized",
+                            "isNative": False,
+                            "tokenAmount": {
+                                "amount": str(amount),
+                                "decimals": decimals,
+                                "uiAmount": ui_amount,
+                                "uiAmountString": str(ui_amount),
+                            },
+                        },
+                    },
+                },
+            },
+        }
+
+    def rendered_accounts(self, owner, encoding) -> str:
+        return self._rendered.get((owner, encoding), json.dumps({"context": {"slot": SLOT}, "value": []}))
+
+    def empty_accounts(self, owner):
+        return [
+            acc["pubkey"] for acc in self.accounts[owner]
+            if acc["account"]["data"]["parsed"]["info"]["tokenAmount"]["amount"] == "0"
+        ]
+
+    def jupiter_price(self, mint):
+        if mint == scanner.SOL_MINT:
+            return 150.0
+        index = self.fungible_index.get(mint)
+        if index is None or index % 10 == 8:
+            return None
+        return self.solscan_price(mint)
+
+    def solscan_price(self, mint):
+        index = self.fungible_index.get(mint)
+        return None if index is None else 0.01 * (index % 500 + 1)
+
+class MockProviders:
+    """
+    Un server aiohttp per provider, ognuno sulla sua porta: semafori e budget di
+    scanner.py restano separati per provider come in produzione (chiave host:porta).
+    Ogni richiesta subisce latenza, 429 e 5xx secondo la configurazione.
+    """
+    def __init__(self, chain, latency=0.0, error_rate=0.0, rate_limit_rate=0.0, seed=0):
+        self.chain = chain
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.injected = Counter()
+        self.urls = {}
+        self._runners = []
+
+    async def start(self):
+        routes = {
+            "rpc": [web.post("/", self.rpc)],
+            "solscan": [
+                web.get("/market/token/{mint}", self.solscan_market),
+            ],
+            "jupiter_price": [web.get("/v4/price", self.jupiter_price)],
+            "jupiter_token": [web.get("/token/{mint}", self.jupiter_token)],
+        }
+        for provider, provider_routes in routes.items():
+            app = web.Application(middlewares=[self._inject])
+            app["provider"] = provider
+            app.add_routes(provider_routes)
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, "127.0.0.1", 0).start()
+            host, port = runner.addresses[0][:2]
+            self.urls[provider] = f"http://{host}:{port}"
+            self._runners.append(runner)
+
+    async def stop(self):
+        for runner in self._runners:
+            await runner.cleanup()
+
+    async def snapshot(self):
+        return Counter(self.calls), Counter(self.injected)
+
+    @web.middleware
+    async def _inject(self, request, handler):
+        provider = request.app["provider"]
+        self.calls[provider] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency * self.random.uniform(0.5, 1.5))
+        roll = self.random.random()
+        if roll < self.rate_limit_rate:
+            self.injected["429"] += 1
+            return web.json_response({"error": "Too Many Requests"}, status=429, headers={"Retry-After": "1"})
+        if roll < self.rate_limit_rate + self.error_rate:
+            self.injected["5xx"] += 1
+            return web.json_response({"error": "Service Unavailable"}, status=503)
+        return await handler(request)
+
+    async def rpc(self, request):
+        body = await request.json()
+        method = body.get("method")
+        params = body.get("params") or []
+        self.calls[f"rpc:{method}"] += 1
+        context = {"slot": SLOT}
+        if method == "getBalance":
+            result = json.dumps({"context": context, "value": 2 * 10 ** 9})
+        elif method == "getTokenAccountsByOwner":
+            encoding = (params[2:] or [{}])[0].get("encoding", "jsonParsed")
+            result = self.chain.rendered_accounts(params[0], encoding)
+        elif method == "getMultipleAccounts":
+            if (params[1:] or [{}])[0].get("encoding") == "base64":
+                value = [self.chain.raw_account(address) for address in params[0]]
+            else:
+                value = [None] * len(params[0])
+            result = json.dumps({"context": context, "value": value})
+        elif method == "getLatestBlockhash":
+            result = json.dumps({"context": context, "value": {"blockhash": BLOCKHASH, "lastValidBlockHeight": SLOT + 150}})
+        else:
+            return web.json_response({
+                "jsonrpc": "2.0", "id": body.get("id"),
+                "error": {"code": -32601, "message": f"Method not found: {method}"}
+            })
+        return web.Response(
+            text=f'{{"jsonrpc":"2.0","id":{json.dumps(body.get("id"))},"result":{result}}}',
+            content_type="application/json"
+        )
+
+    async def solscan_market(self, request):
+        price = self.chain.solscan_price(request.match_info["mint"])
+        if price is None:
+            return web.json_response({}, status=404)
+        return web.json_response({"priceUsdt": price})
+
+    async def jupiter_price(self, request):
+        data = {}
+        for mint in request.query.get("ids", "").split(","):
+            price = self.chain.jupiter_price(mint)
+            if price is not None:
+                data[mint] = {"id": mint, "price": price}
+        return web.json_response({"data": data})
+
+    async def jupiter_token(self, request):
+        mint = request.match_info["mint"]
+        if mint not in self.chain.fungible_index:
+            return web.json_response({}, status=404)
+        return web.json_response({"symbol": mint[:4].upper(), "name": f"Token {mint[:6]}", "decimals": 6, "logoURI": ""})
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))]
+
+class Benchmark:
+    def __init__(self, args):
+        self.args = args
+        self.chain = SyntheticChain()
+        self.mock = MockProviders(self.chain, args.latency, args.error_rate, args.rate_limit_rate, args.seed)
+        self.mock_loop = LoopThread("mock-providers")
+        self.results = []
+        self._devnull = open(os.devnull, "w")
+
+    def configure_scanner(self):
+        urls = self.mock.urls
+        real_urls = {
+            "solscan": scanner.SOLSCAN_API,
+            "jupiter_price": scanner.JUPITER_PRICE_API,
+            "jupiter_token": scanner.JUPITER_TOKEN_API,
+        }
+        scanner.SOLSCAN_API = urls["solscan"]
+        scanner.JUPITER_PRICE_API = urls["jupiter_price"]
+        scanner.JUPITER_TOKEN_API = urls["jupiter_token"]
+        # Concorrenza dei provider reali sulle porte locali; budget reali solo con --provider-limits
+        for provider, real_url in real_urls.items():
+            real_host = urlparse(real_url).hostname
+            host = urlparse(urls[provider]).netloc
+            scanner.PROVIDER_CONCURRENCY[host] = scanner.PROVIDER_CONCURRENCY.get(real_host, scanner.DEFAULT_PROVIDER_CONCURRENCY)
+            scanner.PROVIDER_RATE_LIMITS[host] = (
+                scanner.PROVIDER_RATE_LIMITS.get(real_host, scanner.DEFAULT_PROVIDER_RATE)
+                if self.args.provider_limits else UNLIMITED_RATE
+            )
+        rpc_url = urls["rpc"]
+        scanner.rpc_pool = EndpointPool([rpc_url])
+        scanner.async_solana_client = AsyncEnhancedSolanaClient(
+            rpc_url, max_retries=scanner.MAX_RETRIES, retry_delay=scanner.RATE_LIMIT_RETRY_SECONDS, pool=scanner.rpc_pool
+        )
+        close_accounts.tx_client = AsyncEnhancedSolanaClient(
+            rpc_url, max_retries=scanner.MAX_RETRIES, retry_delay=scanner.RATE_LIMIT_RETRY_SECONDS, pool=scanner.rpc_pool
+        )
+
+    def quiet(self):
+        # Il report di scan_wallet su 5.000 account è enorme: si scarta salvo --verbose
+        if self.args.verbose:
+            return contextlib.nullcontext()
+        return contextlib.redirect_stdout(self._devnull)
+
+    def counters(self):
+        return self.mock_loop.run(self.mock.snapshot())
+
+    async def measure(self, scenario, accounts, runs, body):
+        """Esegue body() `runs` volte; body restituisce True se l'esecuzione è riuscita."""
+        calls_before, injected_before = self.counters()
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        latencies = []
+        failed = 0
+        start = time.perf_counter()
+        for _ in range(runs):
+            if not self.args.warm:
+                clear_caches()
+            run_start = time.perf_counter()
+            with self.quiet():
+                ok = await body()
+            latencies.append(time.perf_counter() - run_start)
+            failed += 0 if ok else 1
+        self.record(scenario, accounts, runs, latencies, failed, time.perf_counter() - start, calls_before, injected_before)
+
+    def record(self, scenario, accounts, runs, latencies, failed, elapsed, calls_before, injected_before):
+        calls_after, injected_after = self.counters()
+        calls = calls_after - calls_before
+        injected = injected_after - injected_before
+        rpc_calls = sum(n for key, n in calls.items() if key.startswith("rpc:"))
+        http_calls = sum(n for key, n in calls.items() if ":" not in key and key != "rpc")
+        self.results.append({
+            "scenario": scenario,
+            "accounts": accounts,
+            "runs": runs,
+            "failed": failed,
+            "elapsed_s": round(elapsed, 3),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "p90_ms": round(percentile(latencies, 90) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+            "max_ms": round(max(latencies) * 1000, 1),
+            "rpc_calls": rpc_calls,
+            "http_calls": http_calls,
+            "injected_429": injected["429"],
+            "injected_5xx": injected["5xx"],
+            "peak_mem_mb": round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1) if tracemalloc.is_tracing() else None,
+            "calls": dict(sorted(calls.items())),
+        })
+        self.print_row(self.results[-1])
+
+    async def bench_scan(self, accounts):
+        wallet = self.chain.wallet(accounts)
+
+        async def body():
+            report = await scanner.scan_wallet(wallet)
+            return bool(report) and report["token_accounts"] == accounts
+
+        await self.measure("scan", accounts, self.args.runs, body)
+
+    async def bench_batch(self):
+        accounts = self.args.batch_accounts
+        wallets = [self.chain.wallet(accounts, tag) for tag in range(self.args.batch_wallets)]
+        latencies = []
+        original_scan = scanner.scan_wallet
+
+        async def timed_scan(*args, **kwargs):
+            # Latenza per wallet all'interno del batch
+            start = time.perf_counter()
+            try:
+                return await original_scan(*args, **kwargs)
+            finally:
+                latencies.append(time.perf_counter() - start)
+
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+            f.write("\n".join(wallets) + "\n")
+            input_file = f.name
+        calls_before, injected_before = self.counters()
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        clear_caches()
+        scanner.scan_wallet = timed_scan
+        start = time.perf_counter()
+        try:
+            with self.quiet():
+                results = await scanner.batch_process(input_file, None, False, self.args.batch_concurrency)
+        finally:
+            scanner.scan_wallet = original_scan
+            os.remove(input_file)
+        elapsed = time.perf_counter() - start
+        failed = len(wallets) - sum(1 for r in results or [] if r["token_accounts"] == accounts)
+        self.record(f"batch×{len(wallets)}", accounts, len(wallets), latencies, failed, elapsed, calls_before, injected_before)
+        print(f"   {len(wallets) / elapsed:.2f} wallet/s")
+
+    async def bench_close(self, accounts):
+        wallet = self.chain.wallet(accounts)
+        empty = self.chain.empty_accounts(wallet)
+
+        async def body():
+            try:
+                tx = await close_accounts.build_close_accounts_tx(wallet, empty, len(empty) * TOKEN_ACCOUNT_RENT)
+            except Exception as e:
+                print(f"Close tx error: {type(e).__name__}: {e}", file=sys.stderr)
+                return False
+            return bool(tx.get("tx"))
+
+        await self.measure("close", accounts, self.args.runs, body)
+
+    def print_header(self):
+        print(f"{'scenario':<12} {'account':>7} {'esec.':>5} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9} "
+              f"{'RPC':>6} {'HTTP':>7} {'429':>5} {'5xx':>5} {'falliti':>7} {'mem MB':>7}")
+
+    def print_row(self, r):
+        mem = "-" if r["peak_mem_mb"] is None else f"{r['peak_mem_mb']:.1f}"
+        print(f"{r['scenario']:<12} {r['accounts']:>7} {r['runs']:>5} {r['p50_ms']:>9.1f} {r['p90_ms']:>9.1f} "
+              f"{r['p99_ms']:>9.1f} {r['max_ms']:>9.1f} {r['rpc_calls']:>6} {r['http_calls']:>7} "
+              f"{r['injected_429']:>5} {r['injected_5xx']:>5} {r['failed']:>7} {mem:>7}")
+
+    async def run(self):
+        self.mock_loop.run(self.mock.start())
+        self.configure_scanner()
+        sizes = [int(s) for s in self.args.sizes.split(",") if s.strip()]
+        scenarios = [s.strip() for s in self.args.scenarios.split(",")]
+        print(f"🧪 Benchmark offline: latenza {self.args.latency * 1000:.0f} ms, "
+              f"errori {self.args.error_rate:.1%}, 429 {self.args.rate_limit_rate:.1%}, "
+              f"cache {'calde' if self.args.warm else 'fredde'}\n")
+        self.print_header()
+        try:
+            if "scan" in scenarios:
+                for accounts in sizes:
+                    await self.bench_scan(accounts)
+            if "batch" in scenarios:
+                await self.bench_batch()
+            if "close" in scenarios:
+                for accounts in sizes:
+                    await self.bench_close(accounts)
+        finally:
+            await scanner.close_clients()
+            await close_accounts.close_client()
+            self.mock_loop.stop(cleanup=self.mock.stop)
+            self._devnull.close()
+        return {
+            "config": vars(self.args),
+            "results": self.results,
+            "http_pool": pool_stats(),
+            "rpc": scanner.rpc_pool.stats(),
+        }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline dello scanner con provider simulati")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="token account per wallet, separati da virgola")
+    parser.add_argument("--runs", type=int, default=3, help="esecuzioni per dimensione")
+    parser.add_argument("--scenarios", default="scan,batch,close", help="scan, batch e/o close")
+    parser.add_argument("--latency", type=float, default=0.01, help="latenza media per richiesta (secondi)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="frazione di risposte 503")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="frazione di risposte 429")
+    parser.add_argument("--provider-limits", action="store_true", help="applica i budget req/s dei provider reali")
+    parser.add_argument("--warm", action="store_true", help="non svuota le cache tra un'esecuzione e l'altra")
+    parser.add_argument("--batch-wallets", type=int, default=50)
+    parser.add_argument("--batch-accounts", type=int, default=20)
+    parser.add_argument("--batch-concurrency", type=int, default=scanner.BATCH_INITIAL_CONCURRENCY)
+    parser.add_argument("--no-memory", action="store_true", help="disattiva tracemalloc (tempi più fedeli, niente picco memoria)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="salva i risultati in JSON")
+    parser.add_argument("--verbose", action="store_true", help="mostra l'output dello scanner")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if sys.platform == 'win32':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    if not args.no_memory:
+        tracemalloc.start()
+    summary = asyncio.run(Benchmark(args).run())
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"\n✅ Risultati salvati in: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Valore restituito da get() quando la chiave non è in cache (None è un valore valido)
+MISSING = object()
+
+_registry = {}
+
+class TTLCache:
+    """
+    Cache LRU con dimensione massima e scadenza per voce.
+    I valori None sono risultati negativi (lookup falliti) e scadono dopo negative_ttl.
+    """
+    def __init__(self, name, maxsize, ttl, negative_ttl=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        _registry[name] = self
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.negative_ttl if value is None else self.ttl
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def update(self, items, ttl=None):
+        for key, value in items.items():
+            self.set(key, value, ttl)
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and entry[1] > time.monotonic()
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+def cache_stats() -> dict:
+    return {name: cache.stats() for name, cache in _registry.items()}
+
+def clear_caches():
+    for cache in _registry.values():
+        cache.clear()
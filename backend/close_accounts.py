@@ -1,17 +1,21 @@
-import asyncio
-from solana.rpc.async_api import AsyncClient
+import base64
+from solana.rpc.types import TxOpts
 from solders.pubkey import Pubkey as PublicKey
 from solders.instruction import Instruction, AccountMeta
 from solders.hash import Hash
 from solders.system_program import ID as SYSTEM_PROGRAM_ID
-from solders.system_program import transfer as system_transfer
+from solders.system_program import transfer as system_transfer, TransferParams
 from solana.transaction import Transaction
 from typing import List
 from config import ALCHEMY_RPC
+from rpc_client import AsyncEnhancedSolanaClient
 
 RECIPIENT_10 = "5AVbEpWRAHhmk2VFwvJMubwvkqbBRxKuXjCWpz9GKqU"
 TOKEN_PROGRAM_ID = PublicKey.from_string("TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA")
 
+# Client RPC condiviso tra le richieste: connessioni aperte per tutta la vita del loop
+tx_client = AsyncEnhancedSolanaClient(ALCHEMY_RPC)
+
 def close_account_ix(acc_pub: PublicKey, user: PublicKey) -> Instruction:
     # SPL Token closeAccount instruction (opcode 9)
     return Instruction(
@@ -31,7 +35,6 @@ async def build_close_accounts_tx(user_pubkey: str, empty_accounts: List[str], r
     - 10% all'indirizzo fisso
     Restituisce la transazione serializzata pronta per la firma lato client.
     """
-    client = AsyncClient(ALCHEMY_RPC)
     user = PublicKey.from_string(user_pubkey)
     recipient_10 = PublicKey.from_string(RECIPIENT_10)
     tx = Transaction()
@@ -48,28 +51,35 @@ async def build_close_accounts_tx(user_pubkey: str, empty_accounts: List[str], r
 
     if lamports_90 > 0:
         tx.add(
-            system_transfer(
+            system_transfer(TransferParams(
                 from_pubkey=user,
                 to_pubkey=user,
                 lamports=lamports_90
-            )
+            ))
         )
 
     if lamports_10 > 0:
         tx.add(
-            system_transfer(
+            system_transfer(TransferParams(
                 from_pubkey=user,
                 to_pubkey=recipient_10,
                 lamports=lamports_10
-            )
+            ))
         )
 
-    recent_blockhash_resp = await client.get_recent_blockhash()
+    recent_blockhash_resp = await tx_client.execute_with_retry("get_latest_blockhash")
     recent_blockhash = recent_blockhash_resp.value.blockhash
     tx.recent_blockhash = recent_blockhash
     tx.fee_payer = user
 
-    await client.close()
-
     # Serializza il messaggio per la firma lato client
     return {"tx": tx.serialize_message().hex()}
+
+async def send_signed_transaction(signed_tx: str) -> str:
+    """Invia la transazione firmata lato client (base64) e restituisce la firma."""
+    tx = Transaction.deserialize(base64.b64decode(signed_tx))
+    resp = await tx_client.execute_with_retry("send_raw_transaction", tx.serialize(), opts=TxOpts(skip_preflight=True))
+    return str(resp.value)
+
+async def close_client():
+    await tx_client.close()
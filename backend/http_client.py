@@ -0,0 +1,107 @@
+import asyncio
+import atexit
+import threading
+import weakref
+
+import aiohttp
+
+# === CONFIG POOL HTTP ===
+HTTP_POOL_LIMIT = 100           # connessioni totali per sessione
+HTTP_POOL_LIMIT_PER_HOST = 20   # connessioni per singolo host (Solscan, Jupiter, Metaplex...)
+DNS_CACHE_TTL = 300             # secondi
+KEEPALIVE_TIMEOUT = 30          # secondi di vita di una connessione inattiva
+HTTP_TIMEOUT = 15
+
+# Una ClientSession è legata al loop che l'ha creata: ne teniamo una per loop
+_sessions = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+_counters = {
+    "sessions_created": 0,
+    "requests": 0,
+    "connections_created": 0,
+    "connections_reused": 0,
+    "dns_cache_hits": 0,
+    "dns_cache_misses": 0,
+}
+
+def _count(name):
+    async def handler(session, ctx, params):
+        _counters[name] += 1
+    return handler
+
+def _trace_config() -> aiohttp.TraceConfig:
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(_count("requests"))
+    trace.on_connection_create_end.append(_count("connections_created"))
+    trace.on_connection_reuseconn.append(_count("connections_reused"))
+    trace.on_dns_cache_hit.append(_count("dns_cache_hits"))
+    trace.on_dns_cache_miss.append(_count("dns_cache_misses"))
+    return trace
+
+def get_session() -> aiohttp.ClientSession:
+    """Restituisce la sessione condivisa del loop corrente, creandola al primo uso."""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        session = _sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=HTTP_POOL_LIMIT,
+                limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+                use_dns_cache=True,
+                ttl_dns_cache=DNS_CACHE_TTL,
+                keepalive_timeout=KEEPALIVE_TIMEOUT,
+            )
+            session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT),
+                trace_configs=[_trace_config()],
+            )
+            _sessions[loop] = session
+            _counters["sessions_created"] += 1
+        return session
+
+async def close_session():
+    """Chiude la sessione del loop corrente (da chiamare prima di chiudere il loop)."""
+    with _lock:
+        session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
+
+def shutdown():
+    # Chiude le sessioni rimaste aperte su loop ancora utilizzabili
+    with _lock:
+        items = list(_sessions.items())
+        _sessions.clear()
+    for loop, session in items:
+        if session.closed or loop.is_closed() or loop.is_running():
+            continue
+        try:
+            loop.run_until_complete(session.close())
+        except Exception as e:
+            print(f"HTTP pool shutdown error: {e}")
+
+atexit.register(shutdown)
+
+def pool_stats() -> dict:
+    """Statistiche del pool per dimensionare limiti e keep-alive."""
+    with _lock:
+        sessions = [s for s in _sessions.values() if not s.closed]
+    in_use = 0
+    idle = 0
+    per_host = {}
+    for session in sessions:
+        connector = session.connector
+        in_use += len(getattr(connector, "_acquired", ()))
+        idle += sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+        for key, conns in getattr(connector, "_acquired_per_host", {}).items():
+            per_host[key.host] = per_host.get(key.host, 0) + len(conns)
+    return {
+        "open_sessions": len(sessions),
+        "limit": HTTP_POOL_LIMIT,
+        "limit_per_host": HTTP_POOL_LIMIT_PER_HOST,
+        "connections_in_use": in_use,
+        "connections_idle": idle,
+        "in_use_per_host": per_host,
+        **_counters,
+    }
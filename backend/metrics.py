@@ -0,0 +1,174 @@
+import contextvars
+import threading
+import time
+
+PREFIX = "wallet_tool_"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry = []
+_lock = threading.Lock()
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, value=1, **labels):
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def lines(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self._values = {}  # labels -> [conteggi per bucket, somma, conteggio]
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        with _lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def lines(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for key, (counts, total, count) in sorted(self._values.items()):
+            for bound, n in zip(self.buckets, counts):
+                yield f"{self.name}_bucket{_labels(self.labelnames, key, [('le', _number(bound))])} {n}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {count}"
+
+scan_phase_seconds = Histogram("scan_phase_seconds", "Durata delle fasi di scan_wallet", ["phase"])
+mint_step_seconds = Histogram("mint_step_seconds", "Durata per mint di classificazione NFT e metadati", ["step"])
+scans_total = Counter("scans_total", "Scansioni completate per esito", ["outcome"])
+rpc_requests_total = Counter("rpc_requests_total", "Richieste RPC per endpoint, metodo ed esito", ["endpoint", "method", "outcome"])
+rpc_request_seconds = Histogram("rpc_request_seconds", "Latenza delle richieste RPC", ["endpoint", "method"])
+rpc_retries_total = Counter("rpc_retries_total", "Tentativi RPC ripetuti dopo un errore", ["method"])
+provider_requests_total = Counter("provider_requests_total", "Richieste HTTP ai provider per stato", ["provider", "status"])
+provider_request_seconds = Histogram("provider_request_seconds", "Latenza delle richieste HTTP ai provider", ["provider"])
+provider_retries_total = Counter("provider_retries_total", "Richieste HTTP ripetute dopo 429 o errore", ["provider"])
+
+# Scansione corrente: i task creati da scan_wallet (gather) ereditano il contesto
+_current_scan = contextvars.ContextVar("current_scan", default=None)
+
+class ScanTimings:
+    """Tempi per fase e chiamate di una singola scansione (blocco "timings" del report)."""
+    def __init__(self):
+        self.phases = {}
+        self.mint_steps = {}  # somma dei tempi per mint (i mint sono elaborati in parallelo)
+        self.calls = {"rpc": {}, "providers": {}}
+        self._last = time.perf_counter()
+
+    def mark(self, phase):
+        """Chiude la fase `phase`: le conta il tempo trascorso dalla fase precedente."""
+        now = time.perf_counter()
+        elapsed, self._last = now - self._last, now
+        self.phases[phase] = self.phases.get(phase, 0.0) + elapsed
+        scan_phase_seconds.observe(elapsed, phase=phase)
+
+    def _entry(self, group, key):
+        entry = self.calls[group].get(key)
+        if entry is None:
+            entry = self.calls[group][key] = {"requests": 0, "errors": 0, "retries": 0, "total_ms": 0.0}
+        return entry
+
+    def to_dict(self) -> dict:
+        return {
+            "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in self.phases.items()},
+            "mint_steps_ms": {name: round(seconds * 1000, 1) for name, seconds in self.mint_steps.items()},
+            "rpc": {k: dict(v, total_ms=round(v["total_ms"], 1)) for k, v in self.calls["rpc"].items()},
+            "providers": {k: dict(v, total_ms=round(v["total_ms"], 1)) for k, v in self.calls["providers"].items()},
+        }
+
+def start_scan(timings: ScanTimings):
+    return _current_scan.set(timings)
+
+def end_scan(token):
+    _current_scan.reset(token)
+
+def record_mint_step(step, seconds):
+    mint_step_seconds.observe(seconds, step=step)
+    timings = _current_scan.get()
+    if timings is not None:
+        timings.mint_steps[step] = timings.mint_steps.get(step, 0.0) + seconds
+
+def record_rpc(endpoint, method, seconds, ok):
+    rpc_requests_total.inc(endpoint=endpoint, method=method, outcome="ok" if ok else "error")
+    rpc_request_seconds.observe(seconds, endpoint=endpoint, method=method)
+    timings = _current_scan.get()
+    if timings is not None:
+        entry = timings._entry("rpc", method)
+        entry["requests"] += 1
+        entry["errors"] += 0 if ok else 1
+        entry["total_ms"] += seconds * 1000
+
+def record_rpc_retry(method):
+    rpc_retries_total.inc(method=method)
+    timings = _current_scan.get()
+    if timings is not None:
+        timings._entry("rpc", method)["retries"] += 1
+
+def record_provider(provider, status, seconds):
+    provider_requests_total.inc(provider=provider, status=status)
+    provider_request_seconds.observe(seconds, provider=provider)
+    timings = _current_scan.get()
+    if timings is not None:
+        entry = timings._entry("providers", provider)
+        entry["requests"] += 1
+        entry["errors"] += 0 if status == 200 else 1
+        entry["total_ms"] += seconds * 1000
+
+def record_provider_retry(provider):
+    provider_retries_total.inc(provider=provider)
+    timings = _current_scan.get()
+    if timings is not None:
+        timings._entry("providers", provider)["retries"] += 1
+
+def render(extra=()) -> str:
+    """
+    Tutte le metriche in formato testo Prometheus.
+    extra: famiglie calcolate al momento, come (nome, help, tipo, [(etichette, valore)]).
+    """
+    lines = []
+    with _lock:
+        for metric in _registry:
+            lines.extend(metric.lines())
+    for name, documentation, kind, samples in extra:
+        lines.append(f"# HELP {PREFIX}{name} {documentation}")
+        lines.append(f"# TYPE {PREFIX}{name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{PREFIX}{name}{_labels(labels.keys(), labels.values())} {_number(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,86 @@
+import json
+import sqlite3
+import threading
+import time
+
+STORE_MAX_AGE = 30 * 24 * 3600  # dopo 30 giorni un record viene riletto dalle API
+SQLITE_MAX_PARAMS = 500         # chiavi per singola query IN (...)
+
+class MintStore:
+    """
+    Archivio SQLite (WAL) dei metadati dei mint, condiviso tra worker gunicorn e riavvii.
+    Ogni riga è (kind, mint) -> record JSON; kind è il nome della cache di scanner.py.
+    Le scritture vengono accodate e salvate in blocco con flush().
+    """
+    def __init__(self, path, max_age=STORE_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS mint_metadata ("
+                " kind TEXT NOT NULL, mint TEXT NOT NULL, data TEXT NOT NULL, updated_at REAL NOT NULL,"
+                " PRIMARY KEY (kind, mint))"
+            )
+            self._conn.commit()
+
+    def get_many(self, mints) -> dict:
+        """Legge tutti i record dei mint indicati: {kind: {mint: record}}."""
+        mints = list(mints)
+        result = {}
+        min_updated = time.time() - self.max_age
+        with self._lock:
+            for i in range(0, len(mints), SQLITE_MAX_PARAMS):
+                chunk = mints[i:i + SQLITE_MAX_PARAMS]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT kind, mint, data FROM mint_metadata WHERE mint IN ({placeholders}) AND updated_at > ?",
+                    (*chunk, min_updated)
+                ).fetchall()
+                for kind, mint, data in rows:
+                    result.setdefault(kind, {})[mint] = json.loads(data)
+        return result
+
+    def put_many(self, kind, records: dict):
+        now = time.time()
+        rows = [(kind, mint, json.dumps(record), now) for mint, record in records.items()]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO mint_metadata (kind, mint, data, updated_at) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+    def queue(self, kind, mint, record):
+        with self._lock:
+            self._pending[(kind, mint)] = record
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        by_kind = {}
+        for (kind, mint), record in pending.items():
+            by_kind.setdefault(kind, {})[mint] = record
+        try:
+            for kind, records in by_kind.items():
+                self.put_many(kind, records)
+        except Exception as e:
+            print(f"Mint store write error: {e}")
+
+    def prune(self, kind, max_age) -> int:
+        """Elimina i record di `kind` più vecchi di max_age secondi; restituisce quanti."""
+        with self._lock:
+            cur = self._conn.execute(
+                "DELETE FROM mint_metadata WHERE kind = ? AND updated_at < ?", (kind, time.time() - max_age)
+            )
+            self._conn.commit()
+            return cur.rowcount
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
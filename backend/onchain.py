@@ -0,0 +1,174 @@
+import asyncio
+import struct
+
+from solders.pubkey import Pubkey as PublicKey
+
+METADATA_PROGRAM_ID = PublicKey.from_string("metaqbxxUerdq28cj1RbAWkYQm3ybzjb6a8bt518x1s")
+METADATA_KEY_V1 = 4      # Key::MetadataV1 nel primo byte dell'account
+CREATOR_SIZE = 34        # pubkey + verified + share
+# Token standard Metaplex: 0 NonFungible, 1 FungibleAsset, 2 Fungible, 3 NonFungibleEdition,
+# 4 ProgrammableNonFungible, 5 ProgrammableNonFungibleEdition
+NFT_TOKEN_STANDARDS = {0, 3, 4, 5}
+
+# Account mint SPL (82 byte): supply u64 all'offset 36, decimals u8 all'offset 44
+MINT_LAYOUT = struct.Struct("<36xQB")
+U32 = struct.Struct("<I")
+# Token account SPL (165 byte): mint 0-32, owner 32-64, amount u64 a 64, delegate 72-108, state u8 a 108
+TOKEN_ACCOUNT_SIZE = 165
+TOKEN_ACCOUNT_LAYOUT = struct.Struct("<32s32xQ36xB")
+ACCOUNT_STATE_UNINITIALIZED = 0
+
+def metadata_address(mint: str) -> PublicKey:
+    """PDA dei metadati Metaplex del mint: ["metadata", program id, mint]."""
+    return PublicKey.find_program_address(
+        [b"metadata", bytes(METADATA_PROGRAM_ID), bytes(PublicKey.from_string(mint))],
+        METADATA_PROGRAM_ID
+    )[0]
+
+def decode_mint(data):
+    """(supply, decimals) dall'account mint, None se i dati non sono un mint."""
+    if data is None or len(data) < MINT_LAYOUT.size:
+        return None
+    return MINT_LAYOUT.unpack_from(data)
+
+def decode_token_accounts(keyed_accounts):
+    """
+    (pubkey, lamports, mint, amount) dagli account di getTokenAccountsByOwner in base64,
+    letti direttamente dai byte. Gli account non inizializzati o di altra dimensione
+    sono scartati; l'indirizzo base58 di ogni mint è calcolato una sola volta.
+    """
+    mints = {}
+    rows = []
+    for keyed in keyed_accounts:
+        account = keyed.account
+        data = account.data
+        if len(data) != TOKEN_ACCOUNT_SIZE:
+            continue
+        raw_mint, amount, state = TOKEN_ACCOUNT_LAYOUT.unpack_from(data)
+        if state == ACCOUNT_STATE_UNINITIALIZED:
+            continue
+        mint = mints.get(raw_mint)
+        if mint is None:
+            mint = mints[raw_mint] = str(PublicKey(raw_mint))
+        rows.append((str(keyed.pubkey), account.lamports, mint, amount))
+    return rows
+
+def _read_string(data, offset):
+    # Stringa borsh: lunghezza u32 e byte UTF-8, con padding di \x00 negli account Metaplex
+    (length,) = U32.unpack_from(data, offset)
+    offset += 4
+    if offset + length > len(data):
+        raise IndexError("string out of bounds")
+    value = bytes(data[offset:offset + length]).decode("utf-8", "replace").rstrip("\x00").strip()
+    return value, offset + length
+
+def decode_metadata(data):
+    """
+    Nome, simbolo, URI, token standard e collezione verificata dall'account Metadata.
+    Gli account più vecchi finiscono prima dei campi opzionali: restano None / "".
+    """
+    if data is None or len(data) < 66 or data[0] != METADATA_KEY_V1:
+        return None
+    data = memoryview(data)
+    result = {"name": "", "symbol": "", "uri": "", "token_standard": None, "collection": ""}
+    try:
+        offset = 1 + 32 + 32  # key, update_authority, mint
+        result["name"], offset = _read_string(data, offset)
+        result["symbol"], offset = _read_string(data, offset)
+        result["uri"], offset = _read_string(data, offset)
+        offset += 2  # seller_fee_basis_points
+        if data[offset]:
+            (creators,) = U32.unpack_from(data, offset + 1)
+            offset += 1 + 4 + creators * CREATOR_SIZE
+        else:
+            offset += 1
+        offset += 2  # primary_sale_happened, is_mutable
+        offset += 2 if data[offset] else 1  # edition_nonce
+        if data[offset]:
+            result["token_standard"] = data[offset + 1]
+            offset += 2
+        else:
+            offset += 1
+        if data[offset] and data[offset + 1] and offset + 34 <= len(data):
+            result["collection"] = str(PublicKey(bytes(data[offset + 2:offset + 34])))
+    except (IndexError, struct.error):
+        pass
+    return result
+
+def classify(supply, decimals, metadata) -> str:
+    if metadata and metadata["token_standard"] is not None:
+        return "nft" if metadata["token_standard"] in NFT_TOKEN_STANDARDS else "fungible"
+    # Nessun token standard (metadati vecchi o assenti): supply 1 e 0 decimali
+    return "nft" if decimals == 0 and supply == 1 else "fungible"
+
+async def fetch_account_data(client, pubkeys, batch=100):
+    """
+    Dati grezzi degli account con getMultipleAccounts (base64), `batch` chiavi per chiamata.
+    Restituisce {pubkey: bytes | None}; le chiavi di un blocco fallito mancano dal risultato.
+    """
+    chunks = [pubkeys[i:i + batch] for i in range(0, len(pubkeys), batch)]
+    responses = await asyncio.gather(*(
+        client.execute_with_retry("get_multiple_accounts", chunk) for chunk in chunks
+    ), return_exceptions=True)
+    result = {}
+    for chunk, resp in zip(chunks, responses):
+        if isinstance(resp, Exception):
+            print(f"getMultipleAccounts error: {resp}")
+            continue
+        for pubkey, account in zip(chunk, resp.value):
+            result[pubkey] = None if account is None else account.data
+    return result
+
+async def load_mint_decimals(client, mints, batch=100) -> dict:
+    """
+    Solo i decimali: legge gli account mint, senza PDA dei metadati né collezioni.
+    Restituisce {mint: decimals}; mancano i mint non letti.
+    """
+    keys = [PublicKey.from_string(m) for m in mints]
+    accounts = await fetch_account_data(client, keys, batch)
+    decimals = {}
+    for mint, key in zip(mints, keys):
+        decoded = decode_mint(accounts.get(key))
+        if decoded is not None:
+            decimals[mint] = decoded[1]
+    return decimals
+
+async def load_mint_records(client, mints, batch=100) -> dict:
+    """
+    Classificazione e metadati dei mint solo via RPC: account mint e PDA Metaplex in
+    blocchi di getMultipleAccounts, poi i metadati delle collezioni per il loro nome.
+    Restituisce {mint: record}; mancano i mint non letti (RPC fallita o mint inesistente).
+    """
+    pdas = {mint: metadata_address(mint) for mint in mints}
+    keys = [PublicKey.from_string(m) for m in mints] + list(pdas.values())
+    accounts = await fetch_account_data(client, keys, batch)
+    records = {}
+    collections = {}
+    for mint, key in zip(mints, keys):
+        if key not in accounts or pdas[mint] not in accounts:
+            continue
+        decoded = decode_mint(accounts[key])
+        if decoded is None:
+            continue
+        supply, decimals = decoded
+        metadata = decode_metadata(accounts[pdas[mint]])
+        records[mint] = {
+            "type": classify(supply, decimals, metadata),
+            "symbol": metadata["symbol"] if metadata else "",
+            "name": metadata["name"] if metadata else "",
+            "decimals": decimals,
+            "icon": "",
+            "uri": metadata["uri"] if metadata else "",
+            "collection": "",
+        }
+        if metadata and metadata["collection"] and records[mint]["type"] == "nft":
+            collections.setdefault(metadata["collection"], []).append(mint)
+    if collections:
+        collection_pdas = {metadata_address(c): c for c in collections}
+        collection_accounts = await fetch_account_data(client, list(collection_pdas), batch)
+        for pda, collection in collection_pdas.items():
+            metadata = decode_metadata(collection_accounts.get(pda))
+            if metadata and metadata["name"]:
+                for mint in collections[collection]:
+                    records[mint]["collection"] = metadata["name"]
+    return records
@@ -0,0 +1,114 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+IDLE_SECONDS = 600     # chiavi inattive oltre questo tempo vengono rimosse
+MAX_KEYS = 10000       # chiavi massime in memoria (LRU)
+PRUNE_EVERY = 1000     # operazioni tra due pulizie dell'archivio SQLite
+
+def _refill(tokens, updated, now, rate, burst):
+    return min(burst, tokens + (now - updated) * rate)
+
+class MemoryTokenBuckets:
+    """
+    Token bucket per chiave nel solo processo: memoria fissa per chiave,
+    chiavi inattive rimosse dopo IDLE_SECONDS e al massimo MAX_KEYS chiavi.
+    """
+    shared = False
+
+    def __init__(self, max_keys=MAX_KEYS, idle_seconds=IDLE_SECONDS):
+        self.max_keys = max_keys
+        self.idle_seconds = idle_seconds
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, key, rate, burst, tokens=1) -> float:
+        """Consuma `tokens` se disponibili e restituisce 0, altrimenti i secondi da attendere."""
+        now = time.monotonic()
+        with self._lock:
+            level, updated = self._buckets.pop(key, (burst, now))
+            if now - updated > self.idle_seconds:
+                level = burst
+            level = _refill(level, updated, now, rate, burst)
+            wait = 0.0
+            if level >= tokens:
+                level -= tokens
+            else:
+                wait = (tokens - level) / rate
+            self._buckets[key] = (level, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            self._evict_idle(now)
+            return wait
+
+    def _evict_idle(self, now):
+        # Le chiavi più vecchie sono in testa: ci si ferma alla prima ancora attiva
+        while self._buckets:
+            key, (_, updated) = next(iter(self._buckets.items()))
+            if now - updated <= self.idle_seconds:
+                break
+            del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+class SQLiteTokenBuckets:
+    """Token bucket per chiave su SQLite: lo stesso budget vale per tutti i worker della macchina."""
+    shared = True
+
+    def __init__(self, path, idle_seconds=IDLE_SECONDS):
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._ops = 0
+        self._conn = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS token_buckets ("
+                " key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+
+    def try_acquire(self, key, rate, burst, tokens=1) -> float:
+        now = time.time()
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                row = cur.execute("SELECT tokens, updated FROM token_buckets WHERE key = ?", (key,)).fetchone()
+                level = burst if row is None else _refill(row[0], row[1], now, rate, burst)
+                wait = 0.0
+                if level >= tokens:
+                    level -= tokens
+                else:
+                    wait = (tokens - level) / rate
+                cur.execute(
+                    "INSERT OR REPLACE INTO token_buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                    (key, level, now)
+                )
+                self._ops += 1
+                if self._ops % PRUNE_EVERY == 0:
+                    cur.execute("DELETE FROM token_buckets WHERE updated < ?", (now - self.idle_seconds,))
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+            return wait
+
+def create_token_buckets(backend="memory", path=None):
+    if backend == "sqlite":
+        return SQLiteTokenBuckets(path)
+    return MemoryTokenBuckets()
+
+async def acquire(buckets, key, rate, burst):
+    """Attende (senza bloccare il loop) finché il bucket non concede un token."""
+    while True:
+        if buckets.shared:
+            wait = await asyncio.to_thread(buckets.try_acquire, key, rate, burst)
+        else:
+            wait = buckets.try_acquire(key, rate, burst)
+        if wait <= 0:
+            return
+        await asyncio.sleep(wait)
@@ -0,0 +1,54 @@
+from dataclasses import dataclass
+
+class Row:
+    """
+    Base delle righe del report: attributi in __slots__ (niente __dict__ per riga),
+    ma leggibili anche come dict (row["symbol"], row.get("uri", "")) dal codice esistente.
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def to_dict(self) -> dict:
+        # Stesso ordine di chiavi dei dict prodotti in precedenza da scan_wallet
+        return {name: getattr(self, name) for name in self.__slots__}
+
+@dataclass(slots=True)
+class TokenRow(Row):
+    mint: str
+    symbol: str
+    name: str
+    balance: float
+    price_usd: float
+    value_usd: float
+    decimals: int
+
+@dataclass(slots=True)
+class NftRow(Row):
+    mint: str
+    symbol: str
+    name: str
+    balance: float
+    decimals: int
+    icon: str
+    uri: str
+    collection: str
+
+@dataclass(slots=True)
+class EmptyAccountRow(Row):
+    pubkey: str
+    mint: str
+    lamports: int
+    is_nft: bool
+
+def json_default(obj):
+    # Da usare come json.dumps(..., default=json_default): le righe diventano i dict di sempre
+    if isinstance(obj, Row):
+        return obj.to_dict()
+    return str(obj)
@@ -0,0 +1,112 @@
+import json
+import sqlite3
+import threading
+import time
+
+from cache import TTLCache, MISSING
+from report_model import json_default
+
+try:
+    import redis
+except ImportError:  # opzionale: serve solo con il backend "redis"
+    redis = None
+
+PRUNE_EVERY = 50  # scritture tra due pulizie dell'archivio SQLite
+
+class MemoryResultCache:
+    """Cache dei risultati nel solo processo corrente."""
+    def __init__(self, ttl, max_entries):
+        self._cache = TTLCache("scan_results", max_entries, ttl)
+
+    def get(self, key):
+        value = self._cache.get(key)
+        return None if value is MISSING else value
+
+    def set(self, key, value):
+        self._cache.set(key, value)
+
+class SQLiteResultCache:
+    """Cache su file SQLite (WAL) condivisa da tutti i worker della stessa macchina."""
+    def __init__(self, path, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS scan_results ("
+                " key TEXT PRIMARY KEY, data TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS scan_results_created ON scan_results (created_at)")
+            self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM scan_results WHERE key = ? AND created_at > ?",
+                (key, time.time() - self.ttl)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value):
+        data = json.dumps(value, default=json_default)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO scan_results (key, data, created_at) VALUES (?, ?, ?)",
+                (key, data, time.time())
+            )
+            self._writes += 1
+            if self._writes % PRUNE_EVERY == 0:
+                self._prune()
+            self._conn.commit()
+
+    def _prune(self):
+        # Elimina le voci scadute e quelle oltre max_entries (le più vecchie)
+        self._conn.execute("DELETE FROM scan_results WHERE created_at <= ?", (time.time() - self.ttl,))
+        self._conn.execute(
+            "DELETE FROM scan_results WHERE key NOT IN "
+            "(SELECT key FROM scan_results ORDER BY created_at DESC LIMIT ?)",
+            (self.max_entries,)
+        )
+
+class RedisResultCache:
+    """Cache su Redis (o compatibili: KeyDB, Valkey, Dragonfly) condivisa tra macchine."""
+    def __init__(self, url, ttl, max_entries, prefix="wallet-tool:scan:"):
+        if redis is None:
+            raise RuntimeError("Il backend redis richiede il pacchetto 'redis' (pip install redis)")
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.prefix = prefix
+        self._index = prefix + "index"
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        data = self._client.get(self.prefix + key)
+        return json.loads(data) if data else None
+
+    def set(self, key, value):
+        now = time.time()
+        pipe = self._client.pipeline()
+        pipe.set(self.prefix + key, json.dumps(value, default=json_default), ex=int(self.ttl))
+        pipe.zadd(self._index, {key: now})
+        pipe.zremrangebyscore(self._index, 0, now - self.ttl)
+        pipe.execute()
+        # Limite di dimensione: rimuove le chiavi più vecchie oltre max_entries
+        overflow = self._client.zcard(self._index) - self.max_entries
+        if overflow > 0:
+            oldest = self._client.zrange(self._index, 0, overflow - 1)
+            if oldest:
+                pipe = self._client.pipeline()
+                pipe.delete(*[self.prefix + k.decode() for k in oldest])
+                pipe.zrem(self._index, *oldest)
+                pipe.execute()
+
+def create_result_cache(backend, ttl, max_entries, path=None, url=None):
+    if backend == "sqlite":
+        return SQLiteResultCache(path, ttl, max_entries)
+    if backend == "redis":
+        return RedisResultCache(url, ttl, max_entries)
+    return MemoryResultCache(ttl, max_entries)
@@ -0,0 +1,281 @@
+import asyncio
+import random
+import threading
+import time
+import weakref
+from collections import deque
+from urllib.parse import urlparse
+
+from solana.rpc.async_api import AsyncClient
+
+import metrics
+
+RPC_TIMEOUT = 30
+MAX_BACKOFF = 20           # secondi, tetto del backoff esponenziale
+MAX_RETRY_AFTER = 60       # secondi, tetto per Retry-After indicato dal nodo
+FAILURE_THRESHOLD = 3      # errori consecutivi che aprono il circuito
+CIRCUIT_OPEN_SECONDS = 30  # durata iniziale del circuito aperto (raddoppia a ogni ricaduta)
+INITIAL_LATENCY = 0.5      # stima per endpoint non ancora misurati
+LATENCY_SAMPLES = 100
+HEDGE_MIN_SAMPLES = 20     # campioni minimi prima di calcolare il p95 per le richieste duplicate
+
+def redact_endpoint(endpoint: str) -> str:
+    # Le URL RPC contengono la API key nel path: nelle statistiche mostriamo solo l'host
+    parsed = urlparse(endpoint)
+    if not parsed.hostname:
+        return endpoint
+    return f"{parsed.hostname}:{parsed.port}" if parsed.port else parsed.hostname
+
+def retry_after_seconds(exc):
+    """Valore di Retry-After (secondi) dalla risposta HTTP che ha causato l'errore, se presente."""
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        response = getattr(exc, "response", None)
+        headers = getattr(response, "headers", None)
+        if headers and headers.get("Retry-After"):
+            try:
+                return min(float(headers["Retry-After"]), MAX_RETRY_AFTER)
+            except ValueError:
+                return None
+        exc = exc.__cause__ or exc.__context__
+    return None
+
+def backoff_delay(attempt, base, retry_after=None):
+    # Backoff esponenziale con full jitter, salvo Retry-After esplicito
+    if retry_after is not None:
+        return retry_after
+    return random.uniform(0, min(MAX_BACKOFF, base * (2 ** attempt)))
+
+class EndpointHealth:
+    def __init__(self, endpoint, index):
+        self.endpoint = endpoint
+        self.index = index
+        self.latency = None          # media mobile esponenziale (secondi)
+        self.error_rate = 0.0        # media mobile esponenziale degli esiti (1 = errore)
+        # Latenze per metodo: getMultipleAccounts da 100 chiavi e getBalance hanno p95 molto diversi
+        self.samples = {}
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.open_seconds = CIRCUIT_OPEN_SECONDS
+        self.trial_in_progress = False
+
+    def score(self):
+        latency = INITIAL_LATENCY if self.latency is None else self.latency
+        return latency * (1 + 4 * self.error_rate)
+
+    def state(self, now):
+        if self.consecutive_failures < FAILURE_THRESHOLD:
+            return "closed"
+        return "open" if now < self.open_until else "half_open"
+
+    def add_sample(self, method, latency):
+        samples = self.samples.get(method)
+        if samples is None:
+            samples = self.samples[method] = deque(maxlen=LATENCY_SAMPLES)
+        samples.append(latency)
+
+    def p95(self, method):
+        samples = self.samples.get(method, ())
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+class EndpointPool:
+    """
+    Stato di salute degli endpoint RPC condiviso dai client async:
+    latenza e tasso d'errore per endpoint, circuit breaker sugli endpoint che falliscono,
+    scelta dell'endpoint sano più veloce.
+    """
+    def __init__(self, endpoints):
+        self.endpoints = list(endpoints)
+        self._health = {e: EndpointHealth(e, i) for i, e in enumerate(self.endpoints)}
+        self._lock = threading.Lock()
+        self.hedged_requests = 0
+
+    def pick(self, exclude=()):
+        now = time.monotonic()
+        with self._lock:
+            candidates = [h for h in self._health.values() if h.endpoint not in exclude]
+            if not candidates:
+                return None
+            available = []
+            for h in candidates:
+                state = h.state(now)
+                if state == "closed" or (state == "half_open" and not h.trial_in_progress):
+                    available.append(h)
+            if not available:
+                if exclude:
+                    return None
+                # Tutti i circuiti aperti: si riprova quello che si riapre per primo
+                best = min(candidates, key=lambda h: h.open_until)
+            else:
+                best = min(available, key=lambda h: (h.score(), h.index))
+            if best.state(now) == "half_open":
+                best.trial_in_progress = True
+            return best.endpoint
+
+    def record_success(self, endpoint, latency, method=None):
+        with self._lock:
+            h = self._health[endpoint]
+            h.requests += 1
+            if method:
+                h.add_sample(method, latency)
+            h.latency = latency if h.latency is None else 0.8 * h.latency + 0.2 * latency
+            h.error_rate *= 0.8
+            h.consecutive_failures = 0
+            h.open_seconds = CIRCUIT_OPEN_SECONDS
+            h.trial_in_progress = False
+
+    def record_failure(self, endpoint, retry_after=None):
+        now = time.monotonic()
+        with self._lock:
+            h = self._health[endpoint]
+            h.requests += 1
+            h.errors += 1
+            h.error_rate = 0.8 * h.error_rate + 0.2
+            was_half_open = h.state(now) == "half_open"
+            h.consecutive_failures += 1
+            h.trial_in_progress = False
+            if h.consecutive_failures >= FAILURE_THRESHOLD:
+                if was_half_open:
+                    h.open_seconds = min(h.open_seconds * 2, 600)
+                h.open_until = now + max(h.open_seconds, retry_after or 0)
+
+    def release_trial(self, endpoint):
+        with self._lock:
+            self._health[endpoint].trial_in_progress = False
+
+    def hedge_delay(self, endpoint, method):
+        with self._lock:
+            return self._health[endpoint].p95(method)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "hedged_requests": self.hedged_requests,
+                "endpoints": [
+                    {
+                        "endpoint": redact_endpoint(h.endpoint),
+                        "state": h.state(now),
+                        "requests": h.requests,
+                        "errors": h.errors,
+                        "error_rate": round(h.error_rate, 4),
+                        "latency_ewma_ms": None if h.latency is None else round(h.latency * 1000, 1),
+                        "latency_p95_ms": {
+                            method: round(p95 * 1000, 1)
+                            for method, p95 in ((m, h.p95(m)) for m in h.samples)
+                            if p95 is not None
+                        },
+                        "consecutive_failures": h.consecutive_failures,
+                    }
+                    for h in self._health.values()
+                ],
+            }
+
+class AsyncEnhancedSolanaClient:
+    """
+    Client RPC asyncio: sceglie l'endpoint sano più veloce
+    dall'EndpointPool, con backoff esponenziale non bloccante. Le letture (get_*)
+    possono essere duplicate su un secondo endpoint oltre il p95 del primo.
+    """
+    def __init__(self, primary_endpoint, backup_endpoints=None, max_retries=5, retry_delay=1.5,
+                 pool=None, hedge=True):
+        self.endpoints = [primary_endpoint] + list(backup_endpoints or [])
+        self.pool = pool or EndpointPool(self.endpoints)
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.hedge = hedge
+        self.error_count = 0
+        # Il pool httpx di AsyncClient è legato al loop: un set di client per loop
+        self._clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _loop_clients(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._clients.get(loop)
+            if clients is None:
+                clients = {endpoint: AsyncClient(endpoint, timeout=RPC_TIMEOUT) for endpoint in self.endpoints}
+                self._clients[loop] = clients
+            return clients
+
+    def get_current_client(self):
+        return self._loop_clients()[self.pool.pick()]
+
+    async def _call(self, endpoint, method_name, args, kwargs):
+        client = self._loop_clients()[endpoint]
+        start = time.monotonic()
+        try:
+            result = await getattr(client, method_name)(*args, **kwargs)
+        except asyncio.CancelledError:
+            # Richiesta duplicata annullata: nessun esito da registrare
+            self.pool.release_trial(endpoint)
+            raise
+        except Exception as e:
+            self.pool.record_failure(endpoint, retry_after_seconds(e))
+            metrics.record_rpc(redact_endpoint(endpoint), method_name, time.monotonic() - start, False)
+            raise
+        latency = time.monotonic() - start
+        self.pool.record_success(endpoint, latency, method_name)
+        metrics.record_rpc(redact_endpoint(endpoint), method_name, latency, True)
+        return result
+
+    async def _hedged_call(self, endpoint, method_name, args, kwargs):
+        deadline = self.pool.hedge_delay(endpoint, method_name)
+        if deadline is None:
+            return await self._call(endpoint, method_name, args, kwargs)
+        first = asyncio.ensure_future(self._call(endpoint, method_name, args, kwargs))
+        done, _ = await asyncio.wait({first}, timeout=deadline)
+        if done:
+            return first.result()
+        # Il backup si sceglie solo ora: pick() prenota la prova di un endpoint half-open
+        backup = self.pool.pick(exclude={endpoint})
+        if backup is None:
+            return await first
+        self.pool.hedged_requests += 1
+        second = asyncio.ensure_future(self._call(backup, method_name, args, kwargs))
+        pending = {first, second}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def execute_with_retry(self, method_name, *args, **kwargs):
+        last_exc = None
+        for attempt in range(self.max_retries):
+            endpoint = self.pool.pick()
+            try:
+                if self.hedge and method_name.startswith("get_"):
+                    return await self._hedged_call(endpoint, method_name, args, kwargs)
+                return await self._call(endpoint, method_name, args, kwargs)
+            except Exception as e:
+                last_exc = e
+                self.error_count += 1
+                if attempt + 1 == self.max_retries:
+                    print(f"RPC error on endpoint {redact_endpoint(endpoint)}: {type(e).__name__}: {e} ({attempt+1}/{self.max_retries})")
+                    break
+                delay = backoff_delay(attempt, self.retry_delay, retry_after_seconds(e))
+                print(f"RPC error on endpoint {redact_endpoint(endpoint)}: {type(e).__name__}: {e}. Retrying in {delay:.2f}s ({attempt+1}/{self.max_retries})...")
+                metrics.record_rpc_retry(method_name)
+                await asyncio.sleep(delay)
+        raise Exception(f"Failed after {self.max_retries} attempts: {last_exc} ({type(last_exc).__name__})")
+
+    async def close(self):
+        # Chiude i client del loop corrente
+        with self._lock:
+            clients = self._clients.pop(asyncio.get_running_loop(), {})
+        for client in clients.values():
+            await client.close()
@@ -4,58 +4,142 @@ import time
 import json
 import csv
 import asyncio
-import aiohttp
 import traceback
+import weakref
 from datetime import datetime
+from urllib.parse import urlparse
 
-from solana.rpc.api import Client
 from solana.rpc.types import TokenAccountOpts
 from solders.pubkey import Pubkey as PublicKey
 
+import metrics
+import onchain
+from cache import TTLCache, MISSING
+from http_client import get_session, close_session
+from mint_store import MintStore
+from rate_limit import create_token_buckets, acquire as acquire_token
+from report_model import TokenRow, NftRow, EmptyAccountRow, json_default
+from rpc_client import AsyncEnhancedSolanaClient, EndpointPool
+
 # === CONFIG ===
 SOLANA_RPC = "https://solana-mainnet.g.alchemy.com/v2/eY-ghQjhqRjXBuzWmmOUXn62584U3CX0"
 BACKUP_RPC = []
 TOKEN_PROGRAM_ID = "TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA"
+SOL_MINT = "So11111111111111111111111111111111111111112"
+# Basi URL dei provider (il benchmark offline le punta a server locali)
+SOLSCAN_API = "https://public-api.solscan.io"
+JUPITER_PRICE_API = "https://price.jup.ag"
+JUPITER_TOKEN_API = "https://token.jup.ag"
 RATE_LIMIT_RETRY_SECONDS = 1.5
 MAX_RETRIES = 5
 API_TIMEOUT = 15
+BATCH_INITIAL_CONCURRENCY = 4  # scansioni parallele iniziali in batch_process
+BATCH_MIN_CONCURRENCY = 1
+BATCH_MAX_CONCURRENCY = 32
+MULTIPLE_ACCOUNTS_BATCH = 100  # limite di chiavi per getMultipleAccounts
+JUPITER_PRICE_BATCH = 100  # ids per richiesta a price.jup.ag
+# Codifica dei token account: base64 (decodifica binaria locale) o jsonParsed (reso dal nodo)
+TOKEN_ACCOUNTS_ENCODING = os.environ.get("TOKEN_ACCOUNTS_ENCODING", "base64")
 
-token_symbol_cache = {}
-token_price_cache = {}
-nft_metadata_cache = {}
+# Richieste HTTP simultanee massime per provider (host)
+PROVIDER_CONCURRENCY = {
+    "public-api.solscan.io": 5,
+    "price.jup.ag": 10,
+    "token.jup.ag": 10,
+}
+DEFAULT_PROVIDER_CONCURRENCY = 5
 
-class EnhancedSolanaClient:
-    def __init__(self, primary_endpoint, backup_endpoints=None):
-        self.primary_client = Client(primary_endpoint)
-        self.backup_clients = [Client(endpoint) for endpoint in (backup_endpoints or [])]
-        self.current_client_index = 0
-        self.clients = [self.primary_client] + self.backup_clients
+# Budget di richieste/secondo per provider, rispettato prima di chiamare (non dopo un 429).
+# RATE_LIMIT_BACKEND=sqlite condivide il budget tra tutti i worker della macchina.
+PROVIDER_RATE_LIMITS = {
+    "public-api.solscan.io": 5.0,
+    "price.jup.ag": 10.0,
+    "token.jup.ag": 10.0,
+}
+DEFAULT_PROVIDER_RATE = 5.0
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_PATH = os.environ.get("RATE_LIMIT_PATH", "rate_limits.db")
 
-    def get_current_client(self):
-        return self.clients[self.current_client_index]
+# Scadenze in secondi: i prezzi cambiano di continuo, i metadati quasi mai
+PRICE_CACHE_TTL = 60
+METADATA_CACHE_TTL = 24 * 3600
+NEGATIVE_CACHE_TTL = 300  # lookup falliti, per non ripeterli ad ogni scansione
+PRICE_CACHE_SIZE = 5000
+METADATA_CACHE_SIZE = 20000
 
-    def rotate_client(self):
-        self.current_client_index = (self.current_client_index + 1) % len(self.clients)
-        return self.get_current_client()
+# REPORT_TIMINGS=1 aggiunge a ogni report il blocco "timings" (fasi, chiamate RPC/HTTP, retry)
+REPORT_TIMINGS = os.environ.get("REPORT_TIMINGS", "0") == "1"
 
-    def execute_with_retry(self, method_name, *args, **kwargs):
-        retries = 0
-        last_exc = None
-        while retries < MAX_RETRIES:
-            try:
-                client = self.get_current_client()
-                method = getattr(client, method_name)
-                return method(*args, **kwargs)
-            except Exception as e:
-                last_exc = e
-                msg = str(e)
-                print(f"RPC error on endpoint {getattr(client, 'endpoint_uri', client)}: {type(e).__name__}: {msg}. Rotating endpoint and retrying ({retries+1}/{MAX_RETRIES})...")
-                self.rotate_client()
-                time.sleep(RATE_LIMIT_RETRY_SECONDS)
-                retries += 1
-        raise Exception(f"Failed after {MAX_RETRIES} attempts: {last_exc} ({type(last_exc).__name__})")
-
-solana_client = EnhancedSolanaClient(SOLANA_RPC, BACKUP_RPC)
+token_symbol_cache = TTLCache("token_symbol", METADATA_CACHE_SIZE, METADATA_CACHE_TTL, NEGATIVE_CACHE_TTL)
+token_price_cache = TTLCache("token_price", PRICE_CACHE_SIZE, PRICE_CACHE_TTL, NEGATIVE_CACHE_TTL)
+nft_metadata_cache = TTLCache("nft_metadata", METADATA_CACHE_SIZE, METADATA_CACHE_TTL, NEGATIVE_CACHE_TTL)
+mint_info_cache = TTLCache("mint_info", METADATA_CACHE_SIZE, METADATA_CACHE_TTL, NEGATIVE_CACHE_TTL)
+
+# Stato dell'ultima scansione per wallet (account e mint già risolti) per le scansioni incrementali
+WALLET_STATE_TTL = METADATA_CACHE_TTL
+WALLET_STATE_CACHE_SIZE = 5000
+wallet_state_cache = TTLCache("wallet_state", WALLET_STATE_CACHE_SIZE, WALLET_STATE_TTL)
+WALLET_STATE_PRUNE_EVERY = 500  # salvataggi tra due pulizie degli stati scaduti nell'archivio
+_wallet_state_saves = 0
+
+# Archivio persistente dei metadati (SQLite); MINT_STORE_PATH vuoto lo disabilita
+MINT_STORE_PATH = os.environ.get("MINT_STORE_PATH", "mint_metadata.db")
+PERSISTED_CACHES = {
+    "mint_info": mint_info_cache,
+    "token_symbol": token_symbol_cache,
+    "nft_metadata": nft_metadata_cache,
+}
+
+def _open_mint_store():
+    if not MINT_STORE_PATH:
+        return None
+    try:
+        return MintStore(MINT_STORE_PATH)
+    except Exception as e:
+        print(f"⚠️ Archivio metadati non disponibile ({MINT_STORE_PATH}): {e}")
+        return None
+
+mint_store = _open_mint_store()
+
+# Stato di salute degli endpoint RPC (anche il benchmark lo sostituisce)
+rpc_pool = EndpointPool([SOLANA_RPC] + BACKUP_RPC)
+async_solana_client = AsyncEnhancedSolanaClient(
+    SOLANA_RPC, BACKUP_RPC, max_retries=MAX_RETRIES, retry_delay=RATE_LIMIT_RETRY_SECONDS, pool=rpc_pool
+)
+
+async def close_clients():
+    # Da chiamare sul loop che ha eseguito le scansioni, prima di chiuderlo
+    await close_session()
+    await async_solana_client.close()
+
+# Risposte 429 ed errori dei provider HTTP: segnale di carico per la concorrenza adattiva
+api_stats = {"rate_limited": 0, "errors": 0}
+
+def provider_pressure() -> int:
+    return api_stats["rate_limited"] + api_stats["errors"] + async_solana_client.error_count
+
+def _create_provider_buckets():
+    try:
+        return create_token_buckets(RATE_LIMIT_BACKEND, RATE_LIMIT_PATH)
+    except Exception as e:
+        print(f"⚠️ Rate limiter {RATE_LIMIT_BACKEND} non disponibile, uso la memoria: {e}")
+        return create_token_buckets("memory")
+
+provider_buckets = _create_provider_buckets()
+
+async def wait_for_provider(host: str):
+    rate = PROVIDER_RATE_LIMITS.get(host, DEFAULT_PROVIDER_RATE)
+    await acquire_token(provider_buckets, f"provider:{host}", rate, rate)
+
+# I semafori asyncio sono legati al loop: uno per provider per ogni loop attivo
+_provider_semaphores = weakref.WeakKeyDictionary()
+_inflight_lookups = weakref.WeakKeyDictionary()
+
+def get_provider_semaphore(host: str) -> asyncio.Semaphore:
+    semaphores = _provider_semaphores.setdefault(asyncio.get_running_loop(), {})
+    if host not in semaphores:
+        semaphores[host] = asyncio.Semaphore(PROVIDER_CONCURRENCY.get(host, DEFAULT_PROVIDER_CONCURRENCY))
+    return semaphores[host]
 
 def lamports_to_sol(lamports: int) -> float:
     return lamports / 1_000_000_000
@@ -69,22 +153,41 @@ def format_number(num: float) -> str:
         return f"{num:.4f}".rstrip('0').rstrip('.') if '.' in f"{num:.4f}" else f"{num}"
 
 async def fetch_api_data(session, url, headers=None):
+    session = session or get_session()
+    # host[:porta]: chiave di semafori e budget dei provider
+    host = urlparse(url).netloc
+    semaphore = get_provider_semaphore(host)
     for attempt in range(MAX_RETRIES):
+        start = time.monotonic()
         try:
-            async with session.get(url, headers=headers, timeout=API_TIMEOUT) as response:
-                if response.status == 200:
-                    return await response.json()
-                elif response.status == 429:
-                    wait_time = RATE_LIMIT_RETRY_SECONDS * (attempt + 1)
-                    print(f"Rate limited. Waiting {wait_time}s before retry...")
-                    await asyncio.sleep(wait_time)
-                    continue
-                else:
-                    print(f"API error: Status code {response.status} for URL: {url}")
-                    return None
+            await wait_for_provider(host)
+            async with semaphore:
+                start = time.monotonic()
+                async with session.get(url, headers=headers, timeout=API_TIMEOUT) as response:
+                    status = response.status
+                    if status == 200:
+                        data = await response.json()
+                        metrics.record_provider(host, status, time.monotonic() - start)
+                        return data
+                metrics.record_provider(host, status, time.monotonic() - start)
+            if status == 429:
+                api_stats["rate_limited"] += 1
+                wait_time = RATE_LIMIT_RETRY_SECONDS * (attempt + 1)
+                print(f"Rate limited. Waiting {wait_time}s before retry...")
+                metrics.record_provider_retry(host)
+                await asyncio.sleep(wait_time)
+                continue
+            else:
+                if status >= 500:
+                    api_stats["errors"] += 1
+                print(f"API error: Status code {status} for URL: {url}")
+                return None
         except Exception as e:
+            api_stats["errors"] += 1
+            metrics.record_provider(host, "error", time.monotonic() - start)
             print(f"API error: {str(e)} for URL: {url}")
             if attempt < MAX_RETRIES - 1:
+                metrics.record_provider_retry(host)
                 await asyncio.sleep(RATE_LIMIT_RETRY_SECONDS)
                 continue
             else:
@@ -92,13 +195,190 @@ async def fetch_api_data(session, url, headers=None):
                 return None
     return None
 
+def persist_mint_metadata(kind, mint_address: str, record: dict):
+    if mint_store is not None:
+        mint_store.queue(kind, mint_address, record)
+
+async def preload_mint_metadata(mint_addresses):
+    """
+    Carica in cache, con una sola lettura batch dall'archivio, i metadati dei mint
+    non ancora in memoria: i mint già noti non generano chiamate HTTP.
+    """
+    if mint_store is None:
+        return
+    missing = [m for m in mint_addresses if m not in mint_info_cache]
+    if not missing:
+        return
+    try:
+        stored = await asyncio.to_thread(mint_store.get_many, missing)
+    except Exception as e:
+        print(f"Mint store read error: {e}")
+        return
+    for kind, records in stored.items():
+        if kind in PERSISTED_CACHES:
+            PERSISTED_CACHES[kind].update(records)
+
+async def flush_mint_metadata():
+    if mint_store is not None:
+        await asyncio.to_thread(mint_store.flush)
+
+async def load_wallet_state(wallet_address: str):
+    state = wallet_state_cache.get(wallet_address)
+    if state is not MISSING:
+        return state
+    if mint_store is None:
+        return None
+    try:
+        stored = await asyncio.to_thread(mint_store.get_many, [wallet_address])
+    except Exception as e:
+        print(f"Mint store read error: {e}")
+        return None
+    state = stored.get("wallet_state", {}).get(wallet_address)
+    if state is None or time.time() - state["scanned_at"] > WALLET_STATE_TTL:
+        return None
+    wallet_state_cache.set(wallet_address, state)
+    return state
+
+def is_fallback_metadata(mint_address: str, metadata: dict) -> bool:
+    # Dict di ripiego di get_token_metadata / get_nft_metadata dopo una ricerca fallita
+    return metadata["symbol"] == mint_address[:4] + "..." and metadata["name"] in ("Unknown", "Unknown NFT")
+
+def wallet_state_mints(enriched: dict) -> dict:
+    """
+    Mint da ricordare per la prossima scansione. I mint con classificazione provvisoria
+    (RPC fallita) non vengono salvati, i metadati di ripiego diventano None: in entrambi
+    i casi la scansione successiva li risolve di nuovo invece di riusarli per WALLET_STATE_TTL.
+    """
+    mints = {}
+    for mint, (nft, metadata) in enriched.items():
+        info = mint_info_cache.get(mint)
+        if info is not MISSING and info.get("provisional"):
+            continue
+        if metadata is not None and is_fallback_metadata(mint, metadata):
+            metadata = None
+        mints[mint] = [nft, metadata]
+    return mints
+
+async def save_wallet_state(wallet_address: str, slot: int, rows, enriched: dict):
+    global _wallet_state_saves
+    previous = wallet_state_cache.get(wallet_address)
+    if previous is not MISSING and previous["slot"] > slot:
+        # Risposta di un nodo rimasto indietro: si tiene lo stato più recente
+        return
+    state = {
+        "slot": slot,
+        "scanned_at": time.time(),
+        "accounts": {pubkey_str: [mint, ui_amount, lamports] for pubkey_str, lamports, mint, ui_amount, _ in rows},
+        "mints": wallet_state_mints(enriched),
+        # Decimali per mint: la scansione successiva in base64 non deve rileggere gli account mint
+        "decimals": {mint: decimals for _, _, mint, _, decimals in rows},
+    }
+    wallet_state_cache.set(wallet_address, state)
+    if mint_store is not None:
+        _wallet_state_saves += 1
+        try:
+            await asyncio.to_thread(mint_store.put_many, "wallet_state", {wallet_address: state})
+            if _wallet_state_saves % WALLET_STATE_PRUNE_EVERY == 0:
+                await asyncio.to_thread(mint_store.prune, "wallet_state", WALLET_STATE_TTL)
+        except Exception as e:
+            print(f"Mint store write error: {e}")
+
+def reuse_wallet_state(previous, rows):
+    """
+    Confronta gli account attuali con lo stato della scansione precedente.
+    Restituisce ({mint: (is_nft, metadata)} riutilizzabili, account nuovi o cambiati, account chiusi):
+    classificazione e metadati non dipendono dai saldi, quindi un mint si risolve di nuovo
+    solo se è nuovo, se passa da vuoto a posseduto o se l'ultima ricerca era fallita
+    (metadati salvati come None o mint non salvato, vedi wallet_state_mints).
+    """
+    if not previous:
+        return {}, len(rows), 0
+    old_accounts = previous["accounts"]
+    held = {}
+    changed = 0
+    for pubkey_str, lamports, mint, ui_amount, _ in rows:
+        held[mint] = held.get(mint, False) or ui_amount != 0
+        if old_accounts.get(pubkey_str) != [mint, ui_amount, lamports]:
+            changed += 1
+    closed = len(old_accounts.keys() - {row[0] for row in rows})
+    reused = {}
+    for mint, h in held.items():
+        entry = previous["mints"].get(mint)
+        if entry is None:
+            continue
+        nft, metadata = entry
+        if h and metadata is None:
+            continue
+        reused[mint] = (nft, metadata if h else None)
+    return reused, changed, closed
+
+async def coalesce(key, factory):
+    # Richieste identiche in corso sullo stesso loop (es. scansioni batch parallele) condividono un solo task
+    lookups = _inflight_lookups.setdefault(asyncio.get_running_loop(), {})
+    task = lookups.get(key)
+    if task is None:
+        task = asyncio.ensure_future(factory())
+        lookups[key] = task
+        task.add_done_callback(lambda _: lookups.pop(key, None))
+    return await asyncio.shield(task)
+
+async def get_mint_info(session, mint_address: str) -> dict:
+    info = mint_info_cache.get(mint_address)
+    if info is not MISSING:
+        return info
+    return await coalesce(("mint_info", mint_address), lambda: resolve_mint_info(session, mint_address))
+
+async def resolve_mint_info(session, mint_address: str) -> dict:
+    """
+    Record unico per mint (tipo, simbolo, nome, decimali, URI, collezione) letto solo
+    via RPC. Usato da is_nft, get_token_metadata e get_nft_metadata.
+    """
+    info = mint_info_cache.get(mint_address)
+    if info is not MISSING:
+        return info
+    records = await load_onchain_mint_info([mint_address])
+    return records[mint_address]
+
+async def load_onchain_mint_info(mint_addresses) -> dict:
+    """
+    Classifica e descrive in blocco i mint non ancora in cache: account mint e metadati
+    Metaplex con poche getMultipleAccounts, decodificati localmente (niente HTTP).
+    Restituisce {mint: record} per i mint letti.
+    """
+    missing = [m for m in dict.fromkeys(mint_addresses) if m not in mint_info_cache]
+    if not missing:
+        return {}
+    records = await onchain.load_mint_records(async_solana_client, missing, MULTIPLE_ACCOUNTS_BATCH)
+    for mint in missing:
+        info = records.get(mint)
+        if info is None:
+            # RPC fallita o mint inesistente: record provvisorio, scade presto e non va salvato
+            info = records[mint] = {
+                "type": "fungible", "symbol": "", "name": "", "decimals": None, "icon": "", "uri": "", "collection": "",
+                "provisional": True,
+            }
+            mint_info_cache.set(mint, info, ttl=NEGATIVE_CACHE_TTL)
+        else:
+            mint_info_cache.set(mint, info)
+            persist_mint_metadata("mint_info", mint, info)
+    return records
+
 async def get_token_metadata(session, mint_address: str) -> dict:
-    if mint_address in token_symbol_cache:
-        return token_symbol_cache[mint_address]
+    cached = token_symbol_cache.get(mint_address)
+    if cached is not MISSING:
+        return cached
     try:
-        data = await fetch_api_data(session, f"https://public-api.solscan.io/token/meta?tokenAddress={mint_address}")
-        if not data or not data.get("symbol"):
-            jupiter_data = await fetch_api_data(session, f"https://token.jup.ag/token/{mint_address}")
+        info = await get_mint_info(session, mint_address)
+        data = None
+        if info["symbol"]:
+            data = {
+                "symbol": info["symbol"],
+                "name": info["name"],
+                "decimals": info["decimals"],
+                "icon": info["icon"]
+            }
+        else:
+            jupiter_data = await fetch_api_data(session, f"{JUPITER_TOKEN_API}/token/{mint_address}")
             if jupiter_data:
                 data = {
                     "symbol": jupiter_data.get("symbol", mint_address[:4] + "..."),
@@ -113,82 +393,86 @@ async def get_token_metadata(session, mint_address: str) -> dict:
                 "decimals": 0,
                 "icon": ""
             }
-        token_symbol_cache[mint_address] = data
+            token_symbol_cache.set(mint_address, data, ttl=NEGATIVE_CACHE_TTL)
+            return data
+        token_symbol_cache.set(mint_address, data)
+        persist_mint_metadata("token_symbol", mint_address, data)
         return data
     except Exception as e:
         print(f"Error getting token metadata for {mint_address}: {e}")
         fallback = {"symbol": mint_address[:4] + "...", "name": "Unknown", "decimals": 0, "icon": ""}
-        token_symbol_cache[mint_address] = fallback
+        token_symbol_cache.set(mint_address, fallback, ttl=NEGATIVE_CACHE_TTL)
         return fallback
 
-async def get_token_price(session, mint_address: str) -> float:
-    if mint_address in token_price_cache:
-        return token_price_cache[mint_address]
+async def get_solscan_price(session, mint_address: str):
+    data = await fetch_api_data(session, f"{SOLSCAN_API}/market/token/{mint_address}")
+    if data and "priceUsdt" in data:
+        return float(data["priceUsdt"])
+    return None
+
+async def get_token_prices(session, mint_addresses) -> dict:
+    """
+    Prezzi USD per più mint: richieste Jupiter da JUPITER_PRICE_BATCH ids ciascuna,
+    fallback Solscan solo per i mint che Jupiter non conosce.
+    """
+    mints = list(dict.fromkeys(mint_addresses))
+    prices = {}
+    missing = []
+    for m in mints:
+        cached = token_price_cache.get(m)
+        if cached is MISSING:
+            missing.append(m)
+        elif cached is not None:
+            prices[m] = cached
     try:
-        data = await fetch_api_data(session, f"https://price.jup.ag/v4/price?ids={mint_address}")
-        if data and "data" in data and mint_address in data["data"]:
-            price = data["data"][mint_address]["price"]
-            token_price_cache[mint_address] = price
-            return price
-        data = await fetch_api_data(session, f"https://public-api.solscan.io/market/token/{mint_address}")
-        if data and "priceUsdt" in data:
-            price = float(data["priceUsdt"])
-            token_price_cache[mint_address] = price
-            return price
-        return 0.0
-    except Exception:
-        return 0.0
+        chunks = [missing[i:i + JUPITER_PRICE_BATCH] for i in range(0, len(missing), JUPITER_PRICE_BATCH)]
+        responses = await asyncio.gather(*(
+            fetch_api_data(session, f"{JUPITER_PRICE_API}/v4/price?ids={','.join(chunk)}")
+            for chunk in chunks
+        ))
+        for data in responses:
+            if data and "data" in data:
+                for mint, entry in data["data"].items():
+                    if entry and entry.get("price") is not None:
+                        prices[mint] = entry["price"]
+        misses = [m for m in missing if m not in prices]
+        fallback = await asyncio.gather(*(get_solscan_price(session, m) for m in misses))
+        for mint, price in zip(misses, fallback):
+            if price is not None:
+                prices[mint] = price
+        # I mint senza prezzo vengono memorizzati come None (cache negativa)
+        token_price_cache.update({m: prices.get(m) for m in missing})
+    except Exception as e:
+        print(f"Error getting token prices: {e}")
+        token_price_cache.update({m: prices[m] for m in missing if m in prices})
+    return {m: prices.get(m, 0.0) for m in mints}
+
+async def get_token_price(session, mint_address: str) -> float:
+    prices = await get_token_prices(session, [mint_address])
+    return prices[mint_address]
 
 async def is_nft(session, mint_address: str) -> bool:
-    data = await fetch_api_data(session, f"https://public-api.solscan.io/token/meta?tokenAddress={mint_address}")
-    if data and data.get("tokenType") == "nft":
-        return True
-    if data and data.get("decimals", 1) == 0 and str(data.get("supply", "2")) in ["1", "1.0"]:
-        return True
-    try:
-        metaplex_data = await fetch_api_data(
-            session,
-            f"https://api.metaplex.solana.com/v1/tokens/{mint_address}/metadata"
-        )
-        if metaplex_data and "uri" in metaplex_data:
-            return True
-    except Exception:
-        pass
-    return False
+    info = await get_mint_info(session, mint_address)
+    return info["type"] == "nft"
 
 async def get_nft_metadata(session, mint_address: str) -> dict:
-    if mint_address in nft_metadata_cache:
-        return nft_metadata_cache[mint_address]
-    data = await fetch_api_data(session, f"https://public-api.solscan.io/nft/meta?tokenAddress={mint_address}")
-    if data and data.get("name"):
+    cached = nft_metadata_cache.get(mint_address)
+    if cached is not MISSING:
+        return cached
+    # Nome, simbolo, URI e collezione dall'account Metadata già decodificato
+    info = await get_mint_info(session, mint_address)
+    if info.get("name"):
         result = {
-            "symbol": data.get("symbol", ""),
-            "name": data.get("name", ""),
+            "symbol": info["symbol"],
+            "name": info["name"],
             "decimals": 0,
-            "icon": data.get("icon", ""),
-            "uri": data.get("metadataUri", ""),
-            "collection": data.get("collection", {}).get("name", ""),
+            "icon": info.get("icon", ""),
+            "uri": info.get("uri", ""),
+            "collection": info.get("collection", ""),
         }
-        nft_metadata_cache[mint_address] = result
+        nft_metadata_cache.set(mint_address, result)
+        persist_mint_metadata("nft_metadata", mint_address, result)
         return result
-    try:
-        metaplex_data = await fetch_api_data(
-            session,
-            f"https://api.metaplex.solana.com/v1/tokens/{mint_address}/metadata"
-        )
-        if metaplex_data and "name" in metaplex_data:
-            result = {
-                "symbol": metaplex_data.get("symbol", ""),
-                "name": metaplex_data.get("name", ""),
-                "decimals": 0,
-                "icon": metaplex_data.get("image", ""),
-                "uri": metaplex_data.get("uri", ""),
-                "collection": metaplex_data.get("collection", {}).get("name", ""),
-            }
-            nft_metadata_cache[mint_address] = result
-            return result
-    except Exception:
-        pass
     fallback = {
         "symbol": mint_address[:4] + "...",
         "name": "Unknown NFT",
@@ -197,110 +481,320 @@ async def get_nft_metadata(session, mint_address: str) -> dict:
         "uri": "",
         "collection": ""
     }
-    nft_metadata_cache[mint_address] = fallback
+    nft_metadata_cache.set(mint_address, fallback, ttl=NEGATIVE_CACHE_TTL)
     return fallback
 
+async def enrich_mint(session, mint_address: str, held: bool):
+    # Catena per singolo mint: classificazione NFT, poi metadati solo se serve
+    start = time.perf_counter()
+    nft = await is_nft(session, mint_address)
+    classified = time.perf_counter()
+    metrics.record_mint_step("nft_detection", classified - start)
+    if not held:
+        return nft, None
+    if nft:
+        metadata = await get_nft_metadata(session, mint_address)
+    else:
+        metadata = await get_token_metadata(session, mint_address)
+    metrics.record_mint_step("metadata", time.perf_counter() - classified)
+    return nft, metadata
+
+def emit_progress(progress, event, data):
+    # Gli errori di chi ascolta non devono interrompere la scansione
+    if progress is None:
+        return
+    try:
+        progress(event, data)
+    except Exception as e:
+        print(f"Progress callback error: {e}")
+
+async def enrich_mints(session, rows, progress=None) -> dict:
+    """
+    Arricchisce tutti i mint del wallet in parallelo (una catena per mint unico).
+    La concorrenza verso ogni provider è limitata dai semafori in fetch_api_data.
+    Restituisce {mint: (is_nft, metadata)}.
+    """
+    held = {}
+    balances = {}
+    for _, _, mint, ui_amount, _ in rows:
+        held[mint] = held.get(mint, False) or ui_amount != 0
+        balances[mint] = balances.get(mint, 0) + ui_amount
+    await preload_mint_metadata(list(held))
+    await load_onchain_mint_info(list(held))
+    done = 0
+
+    async def enrich_and_report(mint, h):
+        nonlocal done
+        nft, metadata = await enrich_mint(session, mint, h)
+        done += 1
+        # Token parziale: metadati già noti, prezzo solo nel report finale
+        emit_progress(progress, "mint_enriched", {
+            "done": done,
+            "total": len(held),
+            "mint": mint,
+            "is_nft": nft,
+            "symbol": metadata.get("symbol", mint[:4] + "...") if metadata else None,
+            "name": metadata.get("name", "Unknown") if metadata else None,
+            "balance": balances[mint],
+        })
+        return nft, metadata
+
+    results = await asyncio.gather(*(enrich_and_report(mint, h) for mint, h in held.items()))
+    await flush_mint_metadata()
+    return dict(zip(held, results))
+
 def extract_parsed_info(account_info):
     try:
-        return account_info.data.parsed.info
+        parsed = account_info.data.parsed
+        if isinstance(parsed, dict):
+            return parsed["info"]
+        return parsed.info
     except Exception:
         return None
 
-async def scan_wallet(wallet_address: str, export_format: str = None, detailed: bool = False):
+async def get_multiple_accounts_parsed(pubkeys):
+    # Una sola chiamata RPC ogni MULTIPLE_ACCOUNTS_BATCH account invece di una per account
+    chunks = [pubkeys[i:i + MULTIPLE_ACCOUNTS_BATCH] for i in range(0, len(pubkeys), MULTIPLE_ACCOUNTS_BATCH)]
+    responses = await asyncio.gather(*(
+        async_solana_client.execute_with_retry("get_multiple_accounts_json_parsed", chunk)
+        for chunk in chunks
+    ))
+    return [info for resp in responses for info in resp.value]
+
+async def load_token_accounts(accounts):
+    """
+    Estrae (pubkey, lamports, info) dalla risposta di get_token_accounts_by_owner_json_parsed.
+    Solo gli account senza dati parsati vengono riletti, in blocchi con getMultipleAccounts.
+    """
+    rows = []
+    missing = []
+    for acc in accounts:
+        parsed_data = extract_parsed_info(acc.account)
+        if parsed_data is None:
+            missing.append(len(rows))
+        rows.append([acc.pubkey, acc.account, parsed_data])
+    if missing:
+        print(f"ℹ️ Rilettura di {len(missing)} account con getMultipleAccounts")
+        infos = await get_multiple_accounts_parsed([rows[i][0] for i in missing])
+        for i, account_info in zip(missing, infos):
+            rows[i][1] = account_info
+            rows[i][2] = extract_parsed_info(account_info)
+    return [
+        (str(pubkey_obj), getattr(account_info, "lamports", 0), parsed_data)
+        for pubkey_obj, account_info, parsed_data in rows
+        if account_info and parsed_data
+    ]
+
+async def fetch_token_accounts_parsed(pubkey):
+    """Token account del wallet come (pubkey, lamports, mint, amount, decimals), via jsonParsed."""
+    resp = await async_solana_client.execute_with_retry(
+        "get_token_accounts_by_owner_json_parsed",
+        pubkey,
+        TokenAccountOpts(program_id=PublicKey.from_string(TOKEN_PROGRAM_ID))
+    )
+    accounts = resp.value if isinstance(resp.value, list) else []
+    rows = []
+    for pubkey_str, lamports, parsed_data in await load_token_accounts(accounts):
+        amount = int(parsed_data["tokenAmount"]["amount"])
+        decimals = int(parsed_data["tokenAmount"]["decimals"])
+        rows.append((pubkey_str, lamports, parsed_data["mint"], amount, decimals))
+    return rows, len(accounts), resp.context.slot
+
+async def fetch_token_accounts_base64(pubkey):
+    """
+    Come fetch_token_accounts_parsed, ma con gli account in base64 decodificati localmente:
+    i decimali non sono nella risposta (None), li completa token_rows.
+    """
+    resp = await async_solana_client.execute_with_retry(
+        "get_token_accounts_by_owner",
+        pubkey,
+        TokenAccountOpts(program_id=PublicKey.from_string(TOKEN_PROGRAM_ID), encoding="base64")
+    )
+    accounts = resp.value if isinstance(resp.value, list) else []
+    rows = [(pubkey_str, lamports, mint, amount, None)
+            for pubkey_str, lamports, mint, amount in onchain.decode_token_accounts(accounts)]
+    return rows, len(accounts), resp.context.slot
+
+async def fetch_token_accounts(pubkey):
+    # jsonParsed resta il fallback se la lettura binaria non è possibile
+    if TOKEN_ACCOUNTS_ENCODING == "base64":
+        try:
+            return await fetch_token_accounts_base64(pubkey)
+        except Exception as e:
+            print(f"⚠️ Lettura base64 dei token account fallita, uso jsonParsed: {e}")
+    return await fetch_token_accounts_parsed(pubkey)
+
+async def resolve_decimals(mints, previous) -> dict:
+    """
+    Decimali dei mint, nell'ordine: stato della scansione precedente, cache (anche su disco),
+    RPC. Via RPC i mint già classificati nello stato leggono solo l'account mint; quelli nuovi
+    vengono classificati per intero, così enrich_mints li trova già in cache.
+    None se i decimali di qualche mint restano sconosciuti.
+    """
+    known = dict(previous.get("decimals", {})) if previous else {}
+    missing = [m for m in dict.fromkeys(mints) if m not in known]
+    if missing:
+        await preload_mint_metadata(missing)
+        for mint in missing:
+            info = mint_info_cache.get(mint)
+            if info is not MISSING and info.get("decimals") is not None:
+                known[mint] = int(info["decimals"])
+        missing = [m for m in missing if m not in known]
+    if missing:
+        classified = previous["mints"] if previous else {}
+        decimals_only = [m for m in missing if m in classified]
+        records, decimals = await asyncio.gather(
+            load_onchain_mint_info([m for m in missing if m not in classified]),
+            onchain.load_mint_decimals(async_solana_client, decimals_only, MULTIPLE_ACCOUNTS_BATCH)
+            if decimals_only else asyncio.sleep(0, {})
+        )
+        known.update(decimals)
+        for mint, info in records.items():
+            if info.get("decimals") is not None:
+                known[mint] = int(info["decimals"])
+        if any(m not in known for m in missing):
+            return None
+    return known
+
+async def token_rows(pubkey, accounts, previous):
+    """
+    (pubkey, lamports, mint, ui_amount, decimals) dagli account di fetch_token_accounts,
+    con i decimali mancanti da resolve_decimals; se restano sconosciuti rilegge in jsonParsed.
+    Restituisce (rows, account_count, slot).
+    """
+    rows, account_count, slot = accounts
+    decimals_by_mint = await resolve_decimals([r[2] for r in rows if r[4] is None], previous)
+    if decimals_by_mint is None:
+        print("⚠️ Decimali non disponibili per alcuni mint, uso jsonParsed")
+        rows, account_count, slot = await fetch_token_accounts_parsed(pubkey)
+    result = []
+    for pubkey_str, lamports, mint, amount, decimals in rows:
+        if decimals is None:
+            decimals = decimals_by_mint[mint]
+        ui_amount = amount / (10 ** decimals) if decimals > 0 else amount
+        result.append((pubkey_str, lamports, mint, ui_amount, decimals))
+    return result, account_count, slot
+
+def failed_report(wallet_address: str, start_time: float, error) -> dict:
+    # Stessa forma del report, a zero, con "error": chi lo riceve non deve trattarlo come un risultato
+    return {
+        "wallet": wallet_address,
+        "error": str(error),
+        "sol_balance": 0,
+        "sol_value_usd": 0,
+        "token_accounts": 0,
+        "empty_accounts": [],
+        "nft_accounts": 0,
+        "rent_reclaimable": 0,
+        "rent_reclaimable_usd": 0,
+        "tokens": [],
+        "nfts": [],
+        "total_token_value_usd": 0,
+        "grand_total_usd": 0,
+        "scan_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "execution_time": time.time() - start_time
+    }
+
+async def scan_wallet(wallet_address: str, export_format: str = None, detailed: bool = False, progress=None,
+                      incremental: bool = True, timings: bool = None):
+    """
+    Scansiona il wallet e restituisce il report.
+    progress(event, data), se indicato, riceve gli eventi di avanzamento:
+    accounts_discovered, mint_enriched (uno per mint), prices_loaded e report.
+    Con incremental=True i mint già risolti nella scansione precedente non vengono
+    richiesti di nuovo: si aggiornano solo saldi e prezzi.
+    Con timings=True (default: REPORT_TIMINGS) il report include il blocco "timings".
+    Se RPC o provider falliscono restituisce un report a zero con la chiave "error".
+    """
     print(f"🔎 Scansione wallet: {wallet_address}")
     start_time = time.time()
+    if timings is None:
+        timings = REPORT_TIMINGS
+    scan_timings = metrics.ScanTimings()
+    token = metrics.start_scan(scan_timings)
     try:
         try:
             pubkey = PublicKey.from_string(wallet_address)
             wallet_address_str = str(pubkey)
         except Exception as e:
             print(f"❌ Indirizzo wallet non valido: {wallet_address}: {e}")
+            metrics.scans_total.inc(outcome="invalid")
             return None
 
         try:
-            print(f"ℹ️ Richiesta get_balance per: {pubkey}")
-            sol_balance_resp = solana_client.execute_with_retry("get_balance", pubkey)
+            print(f"ℹ️ Richiesta get_balance e get_token_accounts_by_owner ({TOKEN_ACCOUNTS_ENCODING}) per: {wallet_address_str}")
+            sol_balance_resp, accounts, previous = await asyncio.gather(
+                async_solana_client.execute_with_retry("get_balance", pubkey),
+                fetch_token_accounts(pubkey),
+                load_wallet_state(wallet_address_str) if incremental else asyncio.sleep(0)
+            )
+            scan_timings.mark("rpc")
+            # Decimali (e classificazione dei mint nuovi) per gli account letti in base64
+            rows, account_count, slot = await token_rows(pubkey, accounts, previous)
+            scan_timings.mark("mint_info")
             sol_balance = lamports_to_sol(sol_balance_resp.value)
             print(f"✅ Bilancio SOL trovato: {sol_balance}")
-
-            print(f"ℹ️ Richiesta get_token_accounts_by_owner_json_parsed per: {wallet_address_str}")
-            resp = solana_client.execute_with_retry(
-                "get_token_accounts_by_owner_json_parsed",
-                pubkey,
-                TokenAccountOpts(program_id=PublicKey.from_string(TOKEN_PROGRAM_ID))
-            )
-            accounts = resp.value if isinstance(resp.value, list) else []
-            print(f"✅ Trovati {len(accounts)} token account\n")
+            print(f"✅ Trovati {account_count} token account\n")
+            emit_progress(progress, "accounts_discovered", {
+                "wallet": wallet_address_str,
+                "sol_balance": sol_balance,
+                "token_accounts": account_count,
+            })
 
             token_data = []
             nft_data = []
             empty_accounts = []
             total_rent_reclaimable = 0
 
-            async with aiohttp.ClientSession() as session:
-                for acc in accounts:
-                    pubkey_obj = acc.pubkey
-                    pubkey_str = str(pubkey_obj)
-                    print(f"ℹ️ Richiesta get_account_info_json_parsed per: {pubkey_str}")
-
-                    account_info_resp = solana_client.execute_with_retry(
-                        "get_account_info_json_parsed",
-                        pubkey_obj
-                    )
-                    account_info = account_info_resp.value
-                    parsed_data = extract_parsed_info(account_info)
-                    if not account_info or not parsed_data:
-                        continue
-
-                    lamports = getattr(account_info, "lamports", 0)
-                    mint = parsed_data["mint"]
-                    amount = int(parsed_data["tokenAmount"]["amount"])
-                    decimals = int(parsed_data["tokenAmount"]["decimals"])
-                    ui_amount = amount / (10 ** decimals) if decimals > 0 else amount
-
-                    if ui_amount == 0:
-                        is_nft_token = await is_nft(session, mint)
-                        empty_accounts.append({
-                            "pubkey": pubkey_str,
-                            "mint": mint,
-                            "lamports": lamports,
-                            "is_nft": is_nft_token
-                        })
-                        if not is_nft_token:
-                            total_rent_reclaimable += lamports
-                    else:
-                        if await is_nft(session, mint):
-                            metadata = await get_nft_metadata(session, mint)
-                            nft_data.append({
-                                "mint": mint,
-                                "symbol": metadata.get("symbol", mint[:4] + "..."),
-                                "name": metadata.get("name", "Unknown"),
-                                "balance": ui_amount,
-                                "decimals": 0,
-                                "icon": metadata.get("icon", ""),
-                                "uri": metadata.get("uri", ""),
-                                "collection": metadata.get("collection", ""),
-                            })
-                        else:
-                            metadata = await get_token_metadata(session, mint)
-                            symbol = metadata.get("symbol", mint[:4] + "...")
-                            name = metadata.get("name", "Unknown")
-                            price = await get_token_price(session, mint)
-                            value_usd = ui_amount * price
-                            token_data.append({
-                                "mint": mint,
-                                "symbol": symbol,
-                                "name": name,
-                                "balance": ui_amount,
-                                "price_usd": price,
-                                "value_usd": value_usd,
-                                "decimals": decimals
-                            })
-
-            token_data.sort(key=lambda x: x["value_usd"], reverse=True)
-            total_value_usd = sum(t["value_usd"] for t in token_data)
-            async with aiohttp.ClientSession() as session:
-                sol_price = await get_token_price(session, "So11111111111111111111111111111111111111112")
+            session = get_session()
+            reused, changed, closed = reuse_wallet_state(previous, rows)
+            if previous:
+                print(f"♻️ Scansione incrementale: {len(reused)} mint riutilizzati, "
+                      f"{changed} account nuovi o modificati, {closed} chiusi")
+            enriched = await enrich_mints(session, [r for r in rows if r[2] not in reused], progress)
+            enriched.update(reused)
+            scan_timings.mark("metadata")
+            if incremental:
+                await save_wallet_state(wallet_address_str, slot, rows, enriched)
+                scan_timings.mark("state")
+            # Un solo giro di prezzi per tutti i token fungibili più SOL
+            priced_mints = [m for m, (nft, metadata) in enriched.items() if metadata is not None and not nft]
+            prices = await get_token_prices(session, priced_mints + [SOL_MINT])
+            sol_price = prices[SOL_MINT]
+            scan_timings.mark("prices")
+            emit_progress(progress, "prices_loaded", {"priced_mints": len(priced_mints), "sol_price": sol_price})
+
+            for pubkey_str, lamports, mint, ui_amount, decimals in rows:
+                is_nft_token, metadata = enriched[mint]
+                if ui_amount == 0:
+                    empty_accounts.append(EmptyAccountRow(pubkey_str, mint, lamports, is_nft_token))
+                    if not is_nft_token:
+                        total_rent_reclaimable += lamports
+                elif is_nft_token:
+                    nft_data.append(NftRow(
+                        mint=mint,
+                        symbol=metadata.get("symbol", mint[:4] + "..."),
+                        name=metadata.get("name", "Unknown"),
+                        balance=ui_amount,
+                        decimals=0,
+                        icon=metadata.get("icon", ""),
+                        uri=metadata.get("uri", ""),
+                        collection=metadata.get("collection", ""),
+                    ))
+                else:
+                    price = prices[mint]
+                    token_data.append(TokenRow(
+                        mint=mint,
+                        symbol=metadata.get("symbol", mint[:4] + "..."),
+                        name=metadata.get("name", "Unknown"),
+                        balance=ui_amount,
+                        price_usd=price,
+                        value_usd=ui_amount * price,
+                        decimals=decimals,
+                    ))
+
+            token_data.sort(key=lambda x: x.value_usd, reverse=True)
+            total_value_usd = sum(t.value_usd for t in token_data)
             sol_value_usd = sol_balance * sol_price
             grand_total_usd = total_value_usd + sol_value_usd
 
@@ -311,9 +805,9 @@ async def scan_wallet(wallet_address: str, export_format: str = None, detailed:
                 "wallet": wallet_address_str,
                 "sol_balance": sol_balance,
                 "sol_value_usd": sol_value_usd,
-                "token_accounts": len(accounts),
+                "token_accounts": account_count,
                 "empty_accounts": empty_accounts,
-                "nft_accounts": len(nft_data) + sum(1 for acc in empty_accounts if acc.get("is_nft")),
+                "nft_accounts": len(nft_data) + sum(1 for acc in empty_accounts if acc.is_nft),
                 "rent_reclaimable": rent_reclaimable_sol,
                 "rent_reclaimable_usd": rent_reclaimable_usd,
                 "tokens": token_data,
@@ -323,7 +817,12 @@ async def scan_wallet(wallet_address: str, export_format: str = None, detailed:
                 "scan_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 "execution_time": time.time() - start_time
             }
+            scan_timings.mark("report")
+            if timings:
+                report["timings"] = scan_timings.to_dict()
+            metrics.scans_total.inc(outcome="ok")
 
+            emit_progress(progress, "report", report)
             print_wallet_report(report, detailed)
             if export_format:
                 export_report(report, wallet_address_str, export_format)
@@ -332,41 +831,15 @@ async def scan_wallet(wallet_address: str, export_format: str = None, detailed:
         except Exception as e:
             print(f"❌ Errore durante la scansione: {str(e)}")
             print(traceback.format_exc())
-            return {
-                "wallet": wallet_address,
-                "sol_balance": 0,
-                "sol_value_usd": 0,
-                "token_accounts": 0,
-                "empty_accounts": [],
-                "nft_accounts": 0,
-                "rent_reclaimable": 0,
-                "rent_reclaimable_usd": 0,
-                "tokens": [],
-                "nfts": [],
-                "total_token_value_usd": 0,
-                "grand_total_usd": 0,
-                "scan_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "execution_time": time.time() - start_time
-            }
+            metrics.scans_total.inc(outcome="error")
+            return failed_report(wallet_address, start_time, e)
     except Exception as e:
         print(f"❌ Errore generale: {str(e)}")
         print(traceback.format_exc())
-        return {
-            "wallet": wallet_address,
-            "sol_balance": 0,
-            "sol_value_usd": 0,
-            "token_accounts": 0,
-            "empty_accounts": [],
-            "nft_accounts": 0,
-            "rent_reclaimable": 0,
-            "rent_reclaimable_usd": 0,
-            "tokens": [],
-            "nfts": [],
-            "total_token_value_usd": 0,
-            "grand_total_usd": 0,
-            "scan_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "execution_time": time.time() - start_time
-        }
+        metrics.scans_total.inc(outcome="error")
+        return failed_report(wallet_address, start_time, e)
+    finally:
+        metrics.end_scan(token)
 
 def print_wallet_report(report: dict, detailed: bool = False):
     print(f"\n{'='*60}")
@@ -439,7 +912,7 @@ def export_report(report: dict, wallet_address: str, format_type: str):
             print(f"✅ Report esportato in: {filename_base}_tokens.csv, {filename_base}_nfts.csv e {filename_base}_summary.csv")
         elif format_type.lower() == "json":
             with open(f"{filename_base}.json", "w", encoding="utf-8") as jsonfile:
-                json.dump(report, jsonfile, indent=2, default=str)
+                json.dump(report, jsonfile, indent=2, default=json_default)
             print(f"✅ Report esportato in: {filename_base}.json")
         elif format_type.lower() == "txt":
             with open(f"{filename_base}.txt", "w", encoding="utf-8") as txtfile:
@@ -483,47 +956,246 @@ def export_report(report: dict, wallet_address: str, format_type: str):
     except Exception as e:
         print(f"❌ Errore durante l'esportazione: {str(e)}")
 
-async def batch_process(input_file: str, export_format: str = None, detailed: bool = False):
+BATCH_CSV_HEADER = [
+    "Wallet", "SOL Balance", "SOL Value USD", "Token Accounts", 
+    "Empty Accounts", "NFT Accounts", "Rent Reclaimable", 
+    "Rent Reclaimable USD", "Token Value USD", "Grand Total USD"
+]
+
+def batch_csv_row(r: dict) -> list:
+    return [
+        r["wallet"], r["sol_balance"], r["sol_value_usd"],
+        r["token_accounts"], len(r["empty_accounts"]), r["nft_accounts"],
+        r["rent_reclaimable"], r["rent_reclaimable_usd"],
+        r["total_token_value_usd"], r["grand_total_usd"]
+    ]
+
+class AdaptiveConcurrency:
+    """
+    Limite di concorrenza AIMD: cresce di 1 dopo `limit` scansioni consecutive senza
+    429/errori dai provider, si dimezza (al massimo una volta ogni `cooldown` secondi)
+    quando pressure() segnala nuovi 429 o errori.
+    """
+    def __init__(self, initial, minimum, maximum, pressure, cooldown=5.0):
+        self.limit = max(minimum, min(initial, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.pressure = pressure
+        self.cooldown = cooldown
+        self.active = 0
+        self._cond = asyncio.Condition()
+        self._successes = 0
+        self._last_pressure = pressure()
+        self._last_decrease = 0.0
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+
+    async def release(self, failed=False):
+        async with self._cond:
+            self.active -= 1
+            self._adjust(failed)
+            self._cond.notify_all()
+
+    def _adjust(self, failed):
+        pressure = self.pressure()
+        throttled = failed or pressure > self._last_pressure
+        self._last_pressure = pressure
+        now = time.monotonic()
+        if throttled:
+            self._successes = 0
+            if now - self._last_decrease >= self.cooldown:
+                self.limit = max(self.minimum, self.limit // 2)
+                self._last_decrease = now
+        else:
+            self._successes += 1
+            if self._successes >= self.limit:
+                self.limit = min(self.maximum, self.limit + 1)
+                self._successes = 0
+
+async def batch_process(input_file: str, export_format: str = None, detailed: bool = False,
+                        concurrency: int = BATCH_INITIAL_CONCURRENCY):
     try:
         with open(input_file, 'r') as f:
             wallets = [line.strip() for line in f if line.strip()]
         print(f"🔄 Elaborazione batch di {len(wallets)} wallet...")
-        results = []
-        for i, wallet in enumerate(wallets):
-            print(f"\n[{i+1}/{len(wallets)}] Elaborazione wallet: {wallet}")
-            result = await scan_wallet(wallet, export_format, detailed)
-            if result:
-                results.append(result)
-            if i < len(wallets) - 1:
-                await asyncio.sleep(1)
+        limiter = AdaptiveConcurrency(concurrency, BATCH_MIN_CONCURRENCY, BATCH_MAX_CONCURRENCY, provider_pressure)
+        results = [None] * len(wallets)
+        completed = 0
+        start_time = time.time()
+
+        async def process(i, wallet):
+            nonlocal completed
+            await limiter.acquire()
+            report = None
+            try:
+                report = results[i] = await scan_wallet(wallet, export_format, detailed)
+            finally:
+                # scan_wallet non solleva: un errore RPC arriva come report con "error"
+                await limiter.release(not report or bool(report.get("error")))
+            completed += 1
+            rate = completed / max(time.time() - start_time, 1e-6)
+            print(f"\n[{completed}/{len(wallets)}] Completato wallet: {wallet} — {rate:.2f} wallet/s, concorrenza {limiter.limit}")
+
+        await asyncio.gather(*(process(i, wallet) for i, wallet in enumerate(wallets)))
+        failed = sum(1 for r in results if r and r.get("error"))
+        results = [r for r in results if r and not r.get("error")]
+        elapsed = time.time() - start_time
+        print(f"✅ Batch completato: {len(results)} wallet in {elapsed:.1f}s ({len(wallets) / max(elapsed, 1e-6):.2f} wallet/s)")
+        if failed:
+            print(f"⚠️ {failed} wallet non scansionati per errori RPC o dei provider")
         if export_format and results:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             filename = f"solana_batch_report_{timestamp}.{export_format}"
             if export_format.lower() == "json":
                 with open(filename, "w") as f:
-                    json.dump(results, f, indent=2, default=str)
+                    json.dump(results, f, indent=2, default=json_default)
             elif export_format.lower() == "csv":
                 with open(filename, "w", newline="") as f:
                     writer = csv.writer(f)
-                    writer.writerow([
-                        "Wallet", "SOL Balance", "SOL Value USD", "Token Accounts", 
-                        "Empty Accounts", "NFT Accounts", "Rent Reclaimable", 
-                        "Rent Reclaimable USD", "Token Value USD", "Grand Total USD"
-                    ])
+                    writer.writerow(BATCH_CSV_HEADER)
                     for r in results:
-                        writer.writerow([
-                            r["wallet"], r["sol_balance"], r["sol_value_usd"],
-                            r["token_accounts"], len(r["empty_accounts"]), r["nft_accounts"],
-                            r["rent_reclaimable"], r["rent_reclaimable_usd"],
-                            r["total_token_value_usd"], r["grand_total_usd"]
-                        ])
+                        writer.writerow(batch_csv_row(r))
             print(f"✅ Report batch esportato in: {filename}")
         return results
     except Exception as e:
         print(f"❌ Errore durante l'elaborazione batch: {str(e)}")
         return None
 
-def generate_recovery_script(wallet_address: str, output_file: str = None):
+def iter_wallets(input_file: str):
+    # Lettura pigra: una riga alla volta, senza caricare tutto il file
+    with open(input_file, 'r') as f:
+        for line in f:
+            wallet = line.strip()
+            if wallet:
+                yield wallet
+
+def load_checkpoint(checkpoint_file: str) -> set:
+    if not checkpoint_file or not os.path.exists(checkpoint_file):
+        return set()
+    with open(checkpoint_file, 'r') as f:
+        return {line.strip() for line in f if line.strip()}
+
+class BatchOutput:
+    """
+    Scrive ogni report appena completato (NDJSON completo o riga CSV di riepilogo) e aggiorna il checkpoint.
+    I report falliti (chiave "error") restano nell'NDJSON ma non nel CSV né nel checkpoint:
+    una ripresa del batch li scansiona di nuovo.
+    """
+    def __init__(self, output_file: str = None, output_format: str = "ndjson", checkpoint_file: str = None):
+        self.output_format = output_format.lower()
+        self._out = None
+        self._csv = None
+        self._checkpoint = open(checkpoint_file, "a", encoding="utf-8") if checkpoint_file else None
+        if output_file:
+            new_file = not os.path.exists(output_file) or os.path.getsize(output_file) == 0
+            self._out = open(output_file, "a", newline="", encoding="utf-8")
+            if self.output_format == "csv":
+                self._csv = csv.writer(self._out)
+                if new_file:
+                    self._csv.writerow(BATCH_CSV_HEADER)
+
+    def write(self, report: dict):
+        failed = bool(report.get("error"))
+        if self._out:
+            if self._csv:
+                if not failed:
+                    self._csv.writerow(batch_csv_row(report))
+            else:
+                self._out.write(json.dumps(report, default=json_default) + "\n")
+            self._out.flush()
+        # Il checkpoint viene scritto solo dopo che il risultato è su disco
+        if self._checkpoint and not failed:
+            self._checkpoint.write(report["wallet"] + "\n")
+            self._checkpoint.flush()
+
+    def close(self):
+        for f in (self._out, self._checkpoint):
+            if f:
+                f.close()
+
+async def stream_batch(input_file: str, output_file: str = None, output_format: str = "ndjson",
+                       checkpoint_file: str = None, export_format: str = None, detailed: bool = False,
+                       concurrency: int = BATCH_INITIAL_CONCURRENCY):
+    """
+    Batch in streaming: legge i wallet pigramente, li scansiona in parallelo con
+    AdaptiveConcurrency e restituisce (async generator) ogni report appena completato.
+    Ogni report è scritto su output_file (e nel checkpoint) appena la scansione finisce,
+    anche se chi consuma il generator è lento o si disconnette; i report non ancora
+    consumati sono al massimo BATCH_MAX_CONCURRENCY, poi le nuove scansioni attendono.
+    Con un checkpoint i wallet già elaborati vengono saltati.
+    """
+    if output_file and checkpoint_file is None:
+        checkpoint_file = output_file + ".checkpoint"
+    done = load_checkpoint(checkpoint_file)
+    if done:
+        print(f"↩️ Ripresa batch: {len(done)} wallet già elaborati verranno saltati")
+    limiter = AdaptiveConcurrency(concurrency, BATCH_MIN_CONCURRENCY, BATCH_MAX_CONCURRENCY, provider_pressure)
+    completed = asyncio.Queue(maxsize=BATCH_MAX_CONCURRENCY)
+    tasks = set()
+    output = BatchOutput(output_file, output_format, checkpoint_file)
+    count = 0
+    start_time = time.time()
+
+    async def process(wallet):
+        nonlocal count
+        failed = False
+        try:
+            report = await scan_wallet(wallet, export_format, detailed)
+            failed = bool(report and report.get("error"))
+            if report:
+                output.write(report)
+                count += 1
+                rate = count / max(time.time() - start_time, 1e-6)
+                outcome = f"Scansione fallita ({report['error']})" if failed else "Completato"
+                print(f"[{count}] {outcome} wallet: {report['wallet']} — {rate:.2f} wallet/s, concorrenza {limiter.limit}")
+                # Coda piena = consumatore lento: lo slot resta occupato e la prossima scansione attende
+                await completed.put(report)
+        except Exception as e:
+            print(f"❌ Errore durante la scansione di {wallet}: {e}")
+            failed = True
+        finally:
+            await limiter.release(failed)
+
+    async def produce():
+        seen = set(done)
+        error = None
+        try:
+            for wallet in iter_wallets(input_file):
+                if wallet in seen:
+                    continue
+                seen.add(wallet)
+                await limiter.acquire()
+                task = asyncio.ensure_future(process(wallet))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            while tasks:
+                await asyncio.gather(*tasks)
+        except Exception as e:
+            error = e
+        # La coda è limitata: il segnale di fine attende il suo posto come gli altri report
+        await completed.put(StopAsyncIteration)
+        if error:
+            raise error
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            report = await completed.get()
+            if report is StopAsyncIteration:
+                break
+            yield report
+        await producer
+    finally:
+        output.close()
+        if not producer.done():
+            producer.cancel()
+            for task in list(tasks):
+                task.cancel()
+
+async def generate_recovery_script(wallet_address: str, output_file: str = None):
     try:
         try:
             pubkey = PublicKey.from_string(wallet_address)
@@ -532,7 +1204,7 @@ def generate_recovery_script(wallet_address: str, output_file: str = None):
             print(f"❌ Indirizzo wallet non valido: {wallet_address}")
             return
 
-        resp = solana_client.execute_with_retry(
+        resp = await async_solana_client.execute_with_retry(
             "get_token_accounts_by_owner_json_parsed",
             pubkey,
             TokenAccountOpts(program_id=PublicKey.from_string(TOKEN_PROGRAM_ID))
@@ -544,17 +1216,7 @@ def generate_recovery_script(wallet_address: str, output_file: str = None):
 
         empty_accounts = []
 
-        for acc in accounts:
-            pubkey_str = str(acc.pubkey)
-            acc_pub = PublicKey.from_string(pubkey_str)
-            account_info_resp = solana_client.execute_with_retry(
-                "get_account_info_json_parsed", acc_pub
-            )
-            account_info = account_info_resp.value
-            parsed_data = extract_parsed_info(account_info)
-            if not account_info or not parsed_data:
-                continue
-
+        for pubkey_str, _, parsed_data in await load_token_accounts(accounts):
             amount = int(parsed_data["tokenAmount"]["amount"])
             if amount == 0:
                 empty_accounts.append(pubkey_str)
@@ -599,3 +1261,28 @@ def generate_recovery_script(wallet_address: str, output_file: str = None):
             print(script)
     except Exception as e:
         print(f"❌ Errore durante la generazione dello script: {str(e)}")
+
+async def run_batch_cli(args):
+    try:
+        async for _ in stream_batch(args.input, output_file=args.output, output_format=args.format,
+                                    checkpoint_file=args.checkpoint, export_format=args.export,
+                                    detailed=args.detailed, concurrency=args.concurrency):
+            pass
+    finally:
+        await close_clients()
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Scansione batch di wallet Solana in streaming")
+    parser.add_argument("input", help="file con un indirizzo wallet per riga")
+    parser.add_argument("--output", help="file dei risultati, scritto man mano che i wallet finiscono")
+    parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson", help="formato di --output")
+    parser.add_argument("--checkpoint", help="wallet già completati: saltati alla ripresa, aggiornati durante il batch")
+    parser.add_argument("--export", choices=["json", "csv", "txt"], help="esporta anche il report di ogni wallet")
+    parser.add_argument("--detailed", action="store_true")
+    parser.add_argument("--concurrency", type=int, default=BATCH_INITIAL_CONCURRENCY)
+    args = parser.parse_args(argv)
+    asyncio.run(run_batch_cli(args))
+
+if __name__ == "__main__":
+    main()
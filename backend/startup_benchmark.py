@@ -0,0 +1,124 @@
+"""
+Benchmark dell'avvio a freddo del backend.
+
+Avvia più volte l'app in un processo Python nuovo (server werkzeug su una porta locale)
+e misura il tempo di import di app, il tempo dalla creazione del processo alla prima
+risposta (time-to-first-response) e la latenza della prima richiesta che importa lo
+scanner (/metrics). Non contatta mainnet né i provider, salvo con --warmup.
+
+Esempi:
+    python startup_benchmark.py
+    python startup_benchmark.py --runs 10 --eager      # come prima degli import differiti
+    python startup_benchmark.py --path /api/cache_stats --output startup.json
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+POLL_INTERVAL = 0.005
+STARTUP_TIMEOUT = 60
+
+# Eseguito nel processo figlio: stampa il tempo di import di app (ms) e resta in ascolto
+SERVER = """
+import sys, time
+start = time.perf_counter()
+if sys.argv[2] == "eager":
+    import scanner, close_accounts
+import app
+from werkzeug.serving import make_server
+server = make_server("127.0.0.1", int(sys.argv[1]), app.app, threaded=True)
+print(f"{(time.perf_counter() - start) * 1000:.1f}", flush=True)
+server.serve_forever()
+"""
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))]
+
+def timed_get(url) -> float:
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=STARTUP_TIMEOUT) as response:
+            response.read()
+    except urllib.error.HTTPError:
+        pass  # anche un 4xx/5xx è una risposta dell'app
+    return time.perf_counter() - start
+
+def measure_once(args, workdir) -> dict:
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=BACKEND_DIR, WARMUP="1" if args.warmup else "0")
+    start = time.perf_counter()
+    child = subprocess.Popen(
+        [sys.executable, "-c", SERVER, str(port), "eager" if args.eager else "lazy"],
+        cwd=workdir, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+    )
+    try:
+        import_ms = float(child.stdout.readline() or "nan")
+        base = f"http://127.0.0.1:{port}"
+        while True:
+            try:
+                timed_get(base + args.path)
+                break
+            except (urllib.error.URLError, ConnectionError):
+                if child.poll() is not None or time.perf_counter() - start > STARTUP_TIMEOUT:
+                    raise RuntimeError("il server non ha risposto")
+                time.sleep(POLL_INTERVAL)
+        ttfr = time.perf_counter() - start
+        first_heavy = timed_get(base + args.heavy_path)
+        return {
+            "import_ms": import_ms,
+            "ttfr_ms": ttfr * 1000,
+            "first_heavy_ms": first_heavy * 1000,
+        }
+    finally:
+        child.terminate()
+        child.wait()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tempo di avvio a freddo del backend")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--path", default="/", help="richiesta usata per il time-to-first-response")
+    parser.add_argument("--heavy-path", default="/metrics", help="prima richiesta che importa lo scanner")
+    parser.add_argument("--eager", action="store_true", help="importa scanner e close_accounts prima di app")
+    parser.add_argument("--warmup", action="store_true", help="avvia l'app con WARMUP=1 (contatta l'RPC)")
+    parser.add_argument("--output", help="salva i risultati in JSON")
+    args = parser.parse_args(argv)
+
+    samples = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for _ in range(args.runs):
+            samples.append(measure_once(args, workdir))
+
+    mode = "eager" if args.eager else "lazy"
+    print(f"🚀 Avvio a freddo ({mode}{', warm-up' if args.warmup else ''}), {args.runs} esecuzioni\n")
+    print(f"{'misura':<28} {'p50 ms':>9} {'p90 ms':>9} {'max ms':>9}")
+    labels = {
+        "import_ms": "import app",
+        "ttfr_ms": f"prima risposta {args.path}",
+        "first_heavy_ms": f"prima {args.heavy_path}",
+    }
+    summary = {}
+    for key, label in labels.items():
+        values = [s[key] for s in samples]
+        summary[key] = {"p50": percentile(values, 50), "p90": percentile(values, 90), "max": max(values)}
+        print(f"{label:<28} {summary[key]['p50']:>9.1f} {summary[key]['p90']:>9.1f} {summary[key]['max']:>9.1f}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "summary": summary, "samples": samples}, f, indent=2)
+        print(f"\n✅ Risultati salvati in: {args.output}")
+
+if __name__ == "__main__":
+    main()